@@ -0,0 +1,131 @@
+"""
+Hermann Böhmer - Login Admission Control
+Begrenzt Login-Versuche pro IP und pro Konto, bevor bcrypt überhaupt läuft
+"""
+
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+# ==================== KONFIGURATION ====================
+
+# Sliding window length for all login limits
+LOGIN_WINDOW_SECONDS = float(os.environ.get('LOGIN_WINDOW_SECONDS', '300'))
+# Attempts per client IP within the window (all accounts together)
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.environ.get('LOGIN_MAX_ATTEMPTS_PER_IP', '30'))
+# Attempts per account (email) within the window (all IPs together)
+LOGIN_MAX_ATTEMPTS_PER_ACCOUNT = int(os.environ.get('LOGIN_MAX_ATTEMPTS_PER_ACCOUNT', '10'))
+
+# Upper bound for tracked keys per limiter - least recently used keys are dropped
+_MAX_TRACKED_KEYS = 100000
+
+
+class LoginRateLimited(Exception):
+    """Raised when a login attempt is not admitted"""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Too many login attempts ({scope})")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+# ==================== LIMITER ====================
+
+class SlidingWindowLimiter:
+    """
+    Exact sliding-window counter: allows `limit` events per key in any
+    `window` seconds. Only the last `limit` timestamps of a key are kept.
+    """
+
+    def __init__(self, limit: int, window: float, max_keys: int = _MAX_TRACKED_KEYS):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._events: OrderedDict = OrderedDict()
+
+    def retry_after(self, key: str, now: float) -> Optional[float]:
+        """Seconds until `key` may try again, or None if it is admitted now"""
+        events = self._events.get(key)
+        if events is None or len(events) < self.limit:
+            return None
+        wait = events[0] + self.window - now
+        return wait if wait > 0 else None
+
+    def hit(self, key: str, now: float):
+        events = self._events.get(key)
+        if events is None:
+            events = self._events[key] = deque(maxlen=self.limit)
+        events.append(now)
+        self._events.move_to_end(key)
+        while len(self._events) > self.max_keys:
+            self._events.popitem(last=False)
+
+    def reset(self, key: str):
+        self._events.pop(key, None)
+
+    def __len__(self):
+        return len(self._events)
+
+
+# ==================== CONTROLLER ====================
+
+class LoginAdmissionController:
+    """
+    Admits a login attempt only if neither its client IP nor its account
+    is over the limit. Rejected attempts are not counted, so a blocked
+    client is let in again as soon as its window has moved on.
+    """
+
+    def __init__(self, per_ip: int, per_account: int, window: float):
+        self.by_ip = SlidingWindowLimiter(per_ip, window)
+        self.by_account = SlidingWindowLimiter(per_account, window)
+
+        # Counters
+        self.admitted = 0
+        self.rejected_ip = 0
+        self.rejected_account = 0
+
+    def admit(self, ip: Optional[str], account: str):
+        """Record an attempt or raise LoginRateLimited"""
+        now = time.monotonic()
+        account = account.lower().strip()
+
+        if ip:
+            wait = self.by_ip.retry_after(ip, now)
+            if wait is not None:
+                self.rejected_ip += 1
+                raise LoginRateLimited('ip', wait)
+
+        wait = self.by_account.retry_after(account, now)
+        if wait is not None:
+            self.rejected_account += 1
+            raise LoginRateLimited('account', wait)
+
+        if ip:
+            self.by_ip.hit(ip, now)
+        self.by_account.hit(account, now)
+        self.admitted += 1
+
+    def succeeded(self, account: str):
+        """A successful login clears the account's failed attempts"""
+        self.by_account.reset(account.lower().strip())
+
+    def stats(self) -> dict:
+        return {
+            "window_seconds": self.by_ip.window,
+            "max_per_ip": self.by_ip.limit,
+            "max_per_account": self.by_account.limit,
+            "admitted": self.admitted,
+            "rejected_ip": self.rejected_ip,
+            "rejected_account": self.rejected_account,
+            "tracked_ips": len(self.by_ip),
+            "tracked_accounts": len(self.by_account)
+        }
+
+
+login_admission = LoginAdmissionController(
+    per_ip=LOGIN_MAX_ATTEMPTS_PER_IP,
+    per_account=LOGIN_MAX_ATTEMPTS_PER_ACCOUNT,
+    window=LOGIN_WINDOW_SECONDS
+)
@@ -0,0 +1,201 @@
+"""
+Hermann Böhmer - Bulk Coupons
+Erzeugt viele Einmal-Gutscheincodes auf einmal (Admin-Endpoint und Kommandozeile)
+
+Beispiel:
+    python bulk_coupons.py --count 10000 --prefix SOMMER- --type percent --value 10 --out sommer.csv
+"""
+
+import io
+import csv
+import sys
+import string
+import uuid
+import asyncio
+import secrets
+import argparse
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, Optional, Set
+
+from cache_bus import CHANNEL as CACHE_CHANNEL
+from database import engine
+
+# Without 0/O and 1/I/L, so codes can be read out and typed in safely
+DEFAULT_ALPHABET = '23456789ABCDEFGHJKMNPQRSTUVWXYZ'
+DEFAULT_LENGTH = 10
+MAX_BULK_COUPONS = 100000
+MAX_CODE_LENGTH = 50  # coupons.code is VARCHAR(50)
+
+# Characters a code may consist of - nothing a CSV or spreadsheet would interpret
+CODE_CHARACTERS = frozenset(string.ascii_uppercase + string.digits)
+PREFIX_CHARACTERS = CODE_CHARACTERS | {'-', '_'}
+
+# Require this many possible codes per requested code, so random
+# generation practically never collides and never runs out of codes
+_MIN_SPACE_FACTOR = 1000
+_MAX_ROUNDS = 5
+
+
+class BulkCouponError(ValueError):
+    """Invalid template or too few possible codes"""
+
+
+def validate_template(count: int, prefix: str, length: int, alphabet: str):
+    if not 1 <= count <= MAX_BULK_COUPONS:
+        raise BulkCouponError(f"count must be between 1 and {MAX_BULK_COUPONS}")
+    if len(prefix) + length > MAX_CODE_LENGTH:
+        raise BulkCouponError(f"prefix + length must not exceed {MAX_CODE_LENGTH} characters")
+    if not set(prefix) <= PREFIX_CHARACTERS:
+        raise BulkCouponError("prefix may only contain A-Z, 0-9, '-' and '_'")
+    if len(set(alphabet)) < 2 or not set(alphabet) <= CODE_CHARACTERS:
+        raise BulkCouponError("alphabet must contain at least two distinct characters from A-Z and 0-9")
+    if len(set(alphabet)) ** length < count * _MIN_SPACE_FACTOR:
+        raise BulkCouponError("alphabet/length allow too few codes for this count")
+
+
+def generate_codes(count: int, prefix: str, length: int, alphabet: str, exclude: Set[str] = frozenset()) -> List[str]:
+    """`count` distinct random codes prefix + length characters, none of them in `exclude`"""
+    alphabet = ''.join(sorted(set(alphabet)))
+    codes = set()
+    while len(codes) < count:
+        code = prefix + ''.join(secrets.choice(alphabet) for _ in range(length))
+        if code not in exclude:
+            codes.add(code)
+    return list(codes)
+
+
+async def create_bulk_coupons(
+    count: int,
+    discount_type: str,
+    discount_value: float,
+    prefix: str = '',
+    length: int = DEFAULT_LENGTH,
+    alphabet: str = DEFAULT_ALPHABET,
+    max_uses: Optional[int] = 1,
+    min_order_value: Optional[float] = None,
+    valid_from: Optional[datetime] = None,
+    valid_until: Optional[datetime] = None,
+    description: Optional[str] = None,
+    is_active: bool = True
+) -> List[str]:
+    """
+    Create `count` coupons sharing one template in a single transaction.
+
+    Codes are COPY'd into a temporary table and moved into coupons with
+    INSERT ... SELECT ... ON CONFLICT (code) DO NOTHING; codes that already
+    existed are replaced by new ones in another round. Returns the codes.
+    """
+    prefix = prefix.strip().upper()
+    validate_template(count, prefix, length, alphabet)
+
+    created: Set[str] = set()
+    now = datetime.now(timezone.utc)
+
+    async with engine.connect() as conn:
+        raw = (await conn.get_raw_connection()).driver_connection
+        async with raw.transaction():
+            await raw.execute(
+                "CREATE TEMP TABLE bulk_coupon_codes (id VARCHAR(36), code VARCHAR(50)) ON COMMIT DROP"
+            )
+            for _ in range(_MAX_ROUNDS):
+                missing = count - len(created)
+                if missing == 0:
+                    break
+                codes = generate_codes(missing, prefix, length, alphabet, exclude=created)
+                await raw.copy_records_to_table(
+                    'bulk_coupon_codes',
+                    records=[(str(uuid.uuid4()), code) for code in codes],
+                    columns=['id', 'code']
+                )
+                rows = await raw.fetch(
+                    """
+                    INSERT INTO coupons (
+                        id, code, discount_type, discount_value, min_order_value, max_uses,
+                        uses_count, valid_from, valid_until, is_active, description, created_at
+                    )
+                    SELECT id, code, $1, $2, $3, $4, 0, $5, $6, $7, $8, $9 FROM bulk_coupon_codes
+                    ON CONFLICT (code) DO NOTHING
+                    RETURNING code
+                    """,
+                    discount_type, discount_value, min_order_value, max_uses,
+                    valid_from, valid_until, is_active, description, now
+                )
+                created.update(row['code'] for row in rows)
+                await raw.execute("TRUNCATE bulk_coupon_codes")
+
+            if len(created) < count:
+                raise BulkCouponError("Could not generate enough unique codes, use a longer code")
+
+            # Delivered on commit: every worker drops cached "unknown code" entries
+            await raw.execute("SELECT pg_notify($1, $2)", CACHE_CHANNEL, "bulk:coupons")
+
+    return sorted(created)
+
+
+def _csv_chunk(rows: Iterable[list]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def csv_lines(codes: Iterable[str], chunk_size: int = 1000) -> Iterator[str]:
+    """CSV (header + one code per line) in chunks, for streaming responses - same format as the CLI"""
+    yield _csv_chunk([['code']])
+    chunk = []
+    for code in codes:
+        chunk.append([code])
+        if len(chunk) >= chunk_size:
+            yield _csv_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield _csv_chunk(chunk)
+
+
+# ==================== CLI ====================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create single-use coupon codes in bulk")
+    parser.add_argument('--count', type=int, required=True)
+    parser.add_argument('--type', dest='discount_type', choices=['percent', 'fixed'], required=True)
+    parser.add_argument('--value', dest='discount_value', type=float, required=True)
+    parser.add_argument('--prefix', default='')
+    parser.add_argument('--length', type=int, default=DEFAULT_LENGTH)
+    parser.add_argument('--alphabet', default=DEFAULT_ALPHABET)
+    parser.add_argument('--max-uses', type=int, default=1)
+    parser.add_argument('--min-order-value', type=float)
+    parser.add_argument('--valid-from', type=datetime.fromisoformat)
+    parser.add_argument('--valid-until', type=datetime.fromisoformat)
+    parser.add_argument('--description')
+    parser.add_argument('--out', help="CSV file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    try:
+        codes = asyncio.run(create_bulk_coupons(
+            count=args.count,
+            discount_type=args.discount_type,
+            discount_value=args.discount_value,
+            prefix=args.prefix,
+            length=args.length,
+            alphabet=args.alphabet,
+            max_uses=args.max_uses,
+            min_order_value=args.min_order_value,
+            valid_from=args.valid_from,
+            valid_until=args.valid_until,
+            description=args.description
+        ))
+    except BulkCouponError as e:
+        parser.error(str(e))
+
+    out = open(args.out, 'w', newline='') if args.out else sys.stdout
+    try:
+        writer = csv.writer(out)
+        writer.writerow(['code'])
+        writer.writerows([code] for code in codes)
+    finally:
+        if args.out:
+            out.close()
+    print(f"✅ {len(codes)} coupons created", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
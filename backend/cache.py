@@ -0,0 +1,355 @@
+"""
+Hermann Böhmer - In-Memory Caches
+Prozess-lokale Caches für selten geänderte Shop-Daten (Katalog, Bewertungen, Versandkosten)
+und für eingeloggte Benutzer (Principals)
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+import orjson
+from sqlalchemy import select
+
+from countries import country_key
+from database import (
+    async_session,
+    Product as DBProduct,
+    Testimonial as DBTestimonial,
+    ShippingRate as DBShippingRate
+)
+
+logger = logging.getLogger(__name__)
+
+# ==================== KONFIGURATION ====================
+
+CUSTOMER_PRINCIPAL_TTL_SECONDS = float(os.environ.get('CUSTOMER_PRINCIPAL_TTL_SECONDS', '60'))
+CUSTOMER_PRINCIPAL_CACHE_SIZE = int(os.environ.get('CUSTOMER_PRINCIPAL_CACHE_SIZE', '10000'))
+COUPON_CACHE_TTL_SECONDS = float(os.environ.get('COUPON_CACHE_TTL_SECONDS', '300'))
+COUPON_CACHE_SIZE = int(os.environ.get('COUPON_CACHE_SIZE', '20000'))
+ADMIN_PRINCIPAL_TTL_SECONDS = float(os.environ.get('ADMIN_PRINCIPAL_TTL_SECONDS', '30'))
+
+
+def row_to_dict(obj) -> dict:
+    """Convert SQLAlchemy row to a JSON-ready dict (same format as server.db_to_dict)"""
+    result = {}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.name)
+        if isinstance(value, datetime):
+            result[column.name] = value.isoformat()
+        else:
+            result[column.name] = value
+    return result
+
+
+# ==================== VERSIONED CACHE ====================
+
+# Upper bound for encoded response variants kept per snapshot
+MAX_PAYLOADS_PER_SNAPSHOT = 256
+
+
+class Snapshot:
+    """Immutable view of a cached table at one content version"""
+
+    __slots__ = ('rows', 'version', 'etag', '_payloads')
+
+    def __init__(self, rows: List[dict], version: int):
+        self.rows = rows
+        self.version = version
+        self._payloads: Dict[Hashable, bytes] = {}
+        # Strong validator derived from the content itself, so it stays
+        # stable across restarts and identical on every worker.
+        digest = hashlib.sha1(orjson.dumps(rows, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        self.etag = f'"{digest[:32]}"'
+
+    def payload(self, key: Hashable, build: Callable[[], Any]) -> bytes:
+        """
+        Return the JSON-encoded response for `key`, encoding it only once per
+        snapshot. A new snapshot (after invalidate) starts with an empty memo.
+        """
+        body = self._payloads.get(key)
+        if body is None:
+            body = orjson.dumps(build())
+            if len(self._payloads) < MAX_PAYLOADS_PER_SNAPSHOT:
+                self._payloads[key] = body
+        return body
+
+
+class VersionedCache:
+    """
+    Holds a snapshot of a table in memory together with a version counter.
+
+    Writers call invalidate() after committing; this bumps the version and
+    drops the snapshot. The next reader reloads it with a single SELECT,
+    all other readers are served from memory without touching the pool.
+    """
+
+    def __init__(self, name: str, loader: Callable[..., Awaitable[List[dict]]]):
+        self.name = name
+        self.version = 0
+        self._loader = loader
+        self._snapshot: Optional[Snapshot] = None
+        self._lock = asyncio.Lock()
+        # Set by the cache bus to tell other workers about invalidations
+        self.on_invalidate: Optional[Callable[[str, Optional[str]], None]] = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._snapshot is not None
+
+    async def get(self) -> List[dict]:
+        """Return the cached rows, loading them on first access"""
+        return (await self.snapshot()).rows
+
+    async def snapshot(self) -> Snapshot:
+        """Return the current snapshot, loading it on first access"""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+
+        async with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+
+            version = self.version
+            async with async_session() as session:
+                rows = await self._loader(session)
+            snapshot = Snapshot(rows, version)
+
+            # A write may have happened while we were loading - only install
+            # the snapshot if it is still current, otherwise serve it once.
+            if version == self.version:
+                self._install(snapshot)
+                logger.info(f"Cache '{self.name}' loaded (v{self.version}, {len(rows)} rows)")
+            return snapshot
+
+    def _install(self, snapshot: Snapshot):
+        self._snapshot = snapshot
+
+    def invalidate(self, broadcast: bool = True):
+        """Bump the version and drop the snapshot - call after every committed write"""
+        self.version += 1
+        self._snapshot = None
+        if broadcast and self.on_invalidate is not None:
+            self.on_invalidate(self.name, None)
+
+
+# ==================== PRODUCT CATALOG ====================
+
+async def _load_products(session) -> List[dict]:
+    result = await session.execute(select(DBProduct))
+    rows = [row_to_dict(p) for p in result.scalars().all()]
+    for p in rows:
+        p['available'] = max(0, p['stock'] - (p.get('reserved_stock') or 0))
+    # Newest first; sorted here (not in SQL) so keyset cursors compare exactly
+    # like this order regardless of the database collation
+    rows.sort(key=lambda p: (p['created_at'] or '', p['id']), reverse=True)
+    return rows
+
+
+def _build_aliases(rows: List[dict]) -> Dict[str, dict]:
+    """Map both id and slug to the product - slugs win on collision (as before)"""
+    aliases = {p['id']: p for p in rows}
+    aliases.update({p['slug']: p for p in rows})
+    return aliases
+
+
+class ProductCatalogCache(VersionedCache):
+    """
+    Product catalog with an alias index, so a product can be resolved by
+    slug or id with one dict lookup.
+
+    Unknown keys are answered from memory as well - product writes reach
+    every worker through the cache bus, so a miss never costs a database
+    round trip (dead links and bots probing slugs included).
+    """
+
+    def __init__(self):
+        super().__init__('products', _load_products)
+        self._aliases: Dict[str, dict] = {}
+
+    def _install(self, snapshot: Snapshot):
+        super()._install(snapshot)
+        self._aliases = _build_aliases(snapshot.rows)
+
+    def lookup(self, snapshot: Snapshot, key: str) -> Optional[dict]:
+        """Resolve a slug or id within a snapshot (no database fallback)"""
+        if snapshot is self._snapshot:
+            return self._aliases.get(key)
+        return _build_aliases(snapshot.rows).get(key)
+
+    async def resolve(self, key: str) -> Tuple[Snapshot, Optional[dict]]:
+        """Resolve a slug or id to (snapshot, product) - product is None if unknown"""
+        snapshot = await self.snapshot()
+        return snapshot, self.lookup(snapshot, key)
+
+
+product_cache = ProductCatalogCache()
+
+
+# ==================== TESTIMONIALS & SHIPPING ====================
+
+async def _load_testimonials(session) -> List[dict]:
+    result = await session.execute(
+        select(DBTestimonial).where(DBTestimonial.is_active == True)
+    )
+    return [row_to_dict(t) for t in result.scalars().all()]
+
+
+async def _load_shipping_rates(session) -> List[dict]:
+    result = await session.execute(
+        select(DBShippingRate).where(DBShippingRate.is_active == True)
+    )
+    return [row_to_dict(r) for r in result.scalars().all()]
+
+
+def _build_country_index(rows: List[dict]) -> Dict[str, dict]:
+    return {country_key(r['country']): r for r in rows}
+
+
+class ShippingRateCache(VersionedCache):
+    """Active shipping rates with an index by normalized country (aliases included)"""
+
+    def __init__(self):
+        super().__init__('shipping_rates', _load_shipping_rates)
+        self._by_country: Dict[str, dict] = {}
+
+    def _install(self, snapshot: Snapshot):
+        super()._install(snapshot)
+        self._by_country = _build_country_index(snapshot.rows)
+
+    async def rate_for(self, country: str) -> Optional[dict]:
+        """Active rate for a country in any known spelling, None if there is none"""
+        snapshot = await self.snapshot()
+        index = self._by_country if snapshot is self._snapshot else _build_country_index(snapshot.rows)
+        return index.get(country_key(country))
+
+
+testimonial_cache = VersionedCache('testimonials', _load_testimonials)
+shipping_rate_cache = ShippingRateCache()
+
+
+# ==================== TTL CACHE ====================
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded LRU mapping whose entries expire `ttl` seconds after being set.
+
+    `generation` is bumped on every pop/clear. Readers that load a value
+    from the database pass the generation they saw before loading to set(),
+    so a value loaded before a concurrent write is not cached after it.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Set by the cache bus to tell other workers about invalidations
+        self.on_invalidate: Optional[Callable[[str, Optional[str]], None]] = None
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] < time.monotonic():
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, generation: Optional[int] = None):
+        if generation is not None and generation != self.generation:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, broadcast: bool = True):
+        self.generation += 1
+        self._data.pop(key, None)
+        if broadcast and self.on_invalidate is not None:
+            self.on_invalidate(self.name, str(key))
+
+    def clear(self, broadcast: bool = True):
+        self.generation += 1
+        self._data.clear()
+        if broadcast and self.on_invalidate is not None:
+            self.on_invalidate(self.name, None)
+
+    def invalidate(self, broadcast: bool = True):
+        self.clear(broadcast)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+# ==================== CUSTOMER PRINCIPALS ====================
+
+class CustomerPrincipal:
+    """
+    Compact, read-only view of a logged-in customer as returned by
+    get_current_customer. Supports customer['id'] / customer.get('email')
+    like the dict it replaces; to_dict() gives the full profile payload.
+    """
+
+    __slots__ = (
+        'id', 'email', 'first_name', 'last_name', 'phone',
+        'default_address', 'default_city', 'default_postal', 'default_country',
+        'billing_address', 'billing_city', 'billing_postal', 'billing_country',
+        'billing_same_as_shipping', 'cart_items', 'newsletter_subscribed', 'created_at'
+    )
+
+    def __init__(self, **values):
+        for field in self.__slots__:
+            setattr(self, field, values.get(field))
+
+    @classmethod
+    def from_row(cls, customer) -> 'CustomerPrincipal':
+        values = {field: getattr(customer, field) for field in cls.__slots__}
+        values['cart_items'] = customer.cart_items or []
+        values['created_at'] = customer.created_at.isoformat() if customer.created_at else None
+        return cls(**values)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+customer_principals = TTLCache('customer_principals', CUSTOMER_PRINCIPAL_CACHE_SIZE, CUSTOMER_PRINCIPAL_TTL_SECONDS)
+
+
+# ==================== ADMIN PRINCIPALS ====================
+
+# {'id', 'email'} for known admins, False for token ids without an admin row.
+# Tokens are signed, so only ids we issued ourselves can end up in here.
+admin_principals = TTLCache('admin_principals', 1000, ADMIN_PRINCIPAL_TTL_SECONDS)
+
+
+# ==================== COUPONS ====================
+
+# Normalized code -> coupon row dict, or False for codes that do not exist.
+# Writers (admin edits, redemptions) pop the code after commit, so uses_count
+# is re-read from the database on the next lookup.
+coupon_cache = TTLCache('coupons', COUPON_CACHE_SIZE, COUPON_CACHE_TTL_SECONDS)
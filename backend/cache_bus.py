@@ -0,0 +1,123 @@
+"""
+Hermann Böhmer - Cache Invalidation Bus
+Verteilt Cache-Invalidierungen über PostgreSQL LISTEN/NOTIFY an alle Worker-Prozesse
+"""
+
+import uuid
+import asyncio
+import logging
+from typing import Dict, Optional
+
+import asyncpg
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'cache_invalidate'
+
+# Wait before reconnecting after the listener connection was lost
+RECONNECT_DELAY_SECONDS = 5
+
+
+class CacheBus:
+    """
+    Keeps one dedicated asyncpg connection per worker that LISTENs on
+    CHANNEL. A registered cache that is invalidated locally NOTIFYs
+    "<origin>:<cache name>" (or "<origin>:<cache name>:<key>" for a single
+    TTLCache entry); every other worker drops its copy. After a lost
+    connection all registered caches are invalidated, since notifications
+    may have been missed in between.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self._caches: Dict[str, object] = {}
+        self._conn: Optional[asyncpg.Connection] = None
+        self._send_lock = asyncio.Lock()
+        self._pending = set()
+
+        # Counters
+        self.sent = 0
+        self.received = 0
+        self.reconnects = 0
+
+    def register(self, *caches):
+        """Broadcast invalidations of these caches (VersionedCache or TTLCache) to all workers"""
+        for cache in caches:
+            self._caches[cache.name] = cache
+            cache.on_invalidate = self._schedule_publish
+
+    def _schedule_publish(self, name: str, key: Optional[str] = None):
+        try:
+            task = asyncio.get_running_loop().create_task(self.publish(name, key))
+        except RuntimeError:
+            return  # no loop (e.g. during shutdown) - nothing to tell
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def publish(self, name: str, key: Optional[str] = None):
+        conn = self._conn
+        if conn is None or conn.is_closed():
+            return
+        payload = f"{self.origin}:{name}" if key is None else f"{self.origin}:{name}:{key}"
+        try:
+            async with self._send_lock:
+                await conn.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+            self.sent += 1
+        except Exception as e:
+            logger.warning(f"Cache invalidation for '{name}' not broadcast: {e}")
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        origin, name, *key = payload.split(':', 2)
+        if origin == self.origin:
+            return
+        cache = self._caches.get(name)
+        if cache is None:
+            return
+        self.received += 1
+        if key:
+            cache.pop(key[0], broadcast=False)
+        else:
+            cache.invalidate(broadcast=False)
+
+    def _invalidate_all(self):
+        for cache in self._caches.values():
+            cache.invalidate(broadcast=False)
+
+    async def run(self):
+        """Background task: keep the LISTEN connection open, reconnect if it drops"""
+        dsn = engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        connected_before = False
+
+        while True:
+            closed = asyncio.Event()
+            try:
+                self._conn = await asyncpg.connect(dsn)
+                self._conn.add_termination_listener(lambda _: closed.set())
+                await self._conn.add_listener(CHANNEL, self._on_notify)
+                if connected_before:
+                    self.reconnects += 1
+                    self._invalidate_all()
+                connected_before = True
+                await closed.wait()
+                logger.warning("Cache bus connection lost, reconnecting")
+            except asyncio.CancelledError:
+                if self._conn is not None and not self._conn.is_closed():
+                    await self._conn.close()
+                raise
+            except Exception as e:
+                logger.error(f"Cache bus error: {e}")
+            self._conn = None
+            await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+
+    def stats(self) -> dict:
+        return {
+            "connected": self._conn is not None and not self._conn.is_closed(),
+            "sent": self.sent,
+            "received": self.received,
+            "reconnects": self.reconnects
+        }
+
+
+cache_bus = CacheBus()
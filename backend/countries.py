@@ -0,0 +1,42 @@
+"""
+Hermann Böhmer - Country Names
+Normalisierung von Ländernamen, damit "Österreich", "Oesterreich" und "Austria" dasselbe Land sind
+"""
+
+from slugify import slugify
+
+# German umlauts are spelled out instead of dropped ("Österreich" -> "oesterreich")
+_UMLAUTS = [
+    ['Ä', 'Ae'], ['Ö', 'Oe'], ['Ü', 'Ue'],
+    ['ä', 'ae'], ['ö', 'oe'], ['ü', 'ue'], ['ß', 'ss'],
+]
+
+# Normalized German name (as used for shipping rates) -> other spellings
+COUNTRY_ALIASES = {
+    'oesterreich': ('osterreich', 'austria', 'autriche', 'at', 'aut'),
+    'deutschland': ('germany', 'allemagne', 'de', 'deu'),
+    'schweiz': ('switzerland', 'suisse', 'svizzera', 'ch', 'che'),
+    'liechtenstein': ('li', 'lie'),
+    'italien': ('italy', 'italia', 'it', 'ita'),
+    'frankreich': ('france', 'fr', 'fra'),
+    'niederlande': ('netherlands', 'nederland', 'holland', 'nl', 'nld'),
+    'belgien': ('belgium', 'belgique', 'belgie', 'be', 'bel'),
+    'luxemburg': ('luxembourg', 'lu', 'lux'),
+}
+
+_CANONICAL = {
+    alias: canonical
+    for canonical, aliases in COUNTRY_ALIASES.items()
+    for alias in (canonical,) + aliases
+}
+
+
+def normalize_country(name: str) -> str:
+    """Lowercase ASCII slug of a country name ("Österreich " -> "oesterreich")"""
+    return slugify(name or '', replacements=_UMLAUTS)
+
+
+def country_key(name: str) -> str:
+    """Key under which a country is looked up - all known aliases share one key"""
+    normalized = normalize_country(name)
+    return _CANONICAL.get(normalized, normalized)
@@ -65,6 +65,7 @@ class Product(Base):
     image_url = Column(String(512), nullable=False)
     category = Column(String(50), nullable=False, default='likoer', index=True)
     stock = Column(Integer, nullable=False, default=100)
+    reserved_stock = Column(Integer, nullable=False, default=0, server_default='0')  # held by open checkouts
     is_featured = Column(Boolean, default=False)
     is_limited = Column(Boolean, default=False)
     is_18_plus = Column(Boolean, default=False)
@@ -373,6 +374,26 @@ class PendingCheckoutSession(Base):
     completed_at = Column(DateTime(timezone=True), nullable=True)
 
 
+class InvoiceCounter(Base):
+    """Last invoice number issued per year (allocated by invoice_numbers.py)"""
+    __tablename__ = 'invoice_counters'
+
+    year = Column(Integer, primary_key=True, autoincrement=False)
+    last_number = Column(Integer, nullable=False, default=0)
+
+
+class StockReservation(Base):
+    """Quantity held for an open checkout until expires_at (summed in products.reserved_stock)"""
+    __tablename__ = 'stock_reservations'
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    checkout_session_id = Column(String(36), nullable=False, index=True)
+    product_id = Column(String(36), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+
 # ==================== DATABASE HELPERS ====================
 
 async def init_db():
@@ -393,6 +414,86 @@ async def init_db():
                 END IF;
             END $$;
         """))
+
+        # Full-text search: generated tsvector over both languages + tags, GIN indexed
+        await conn.execute(text("""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'products' AND column_name = 'search_vector'
+                ) THEN
+                    ALTER TABLE products ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+                        setweight(to_tsvector('german', coalesce(name_de, '')), 'A') ||
+                        setweight(to_tsvector('english', coalesce(name_en, '')), 'A') ||
+                        setweight(to_tsvector('simple', coalesce(tags::text, '')), 'B') ||
+                        setweight(to_tsvector('german', coalesce(description_de, '')), 'C') ||
+                        setweight(to_tsvector('english', coalesce(description_en, '')), 'C')
+                    ) STORED;
+                END IF;
+            END $$;
+        """))
+        await conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING GIN (search_vector)"
+        ))
+
+        # Stock reservations: running total of active holds per product
+        await conn.execute(text(
+            "ALTER TABLE products ADD COLUMN IF NOT EXISTS reserved_stock INTEGER NOT NULL DEFAULT 0"
+        ))
+
+        # At most one order per Stripe payment (order finalization inserts ON CONFLICT against it).
+        # Duplicates left by concurrent payment polls keep their data, but only the oldest order
+        # keeps the Stripe session; the others are detached and flagged for the admin
+        await conn.execute(text("""
+            UPDATE orders o
+            SET stripe_session_id = NULL,
+                admin_notes = concat_ws(E'\\n', o.admin_notes,
+                    '⚠️ Doppelte Bestellung zur Stripe-Sitzung ' || d.stripe_session_id
+                    || ' (Original: ' || d.original_id || ')')
+            FROM (
+                SELECT id, stripe_session_id,
+                       first_value(id) OVER w AS original_id,
+                       row_number() OVER w AS n
+                FROM orders
+                WHERE stripe_session_id IS NOT NULL
+                WINDOW w AS (PARTITION BY stripe_session_id ORDER BY created_at, id)
+            ) d
+            WHERE o.id = d.id AND d.n > 1
+        """))
+        await conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_orders_stripe_session_id "
+            "ON orders (stripe_session_id) WHERE stripe_session_id IS NOT NULL"
+        ))
+
+        # Invoice counters continue after the highest number already issued per year
+        await conn.execute(text(r"""
+            INSERT INTO invoice_counters (year, last_number)
+            SELECT split_part(invoice_number, '-', 2)::int, max(split_part(invoice_number, '-', 3)::int)
+            FROM orders
+            WHERE invoice_number ~ '^RE-\d{4}-\d+$'
+            GROUP BY 1
+            ON CONFLICT (year) DO UPDATE
+                SET last_number = greatest(invoice_counters.last_number, EXCLUDED.last_number)
+        """))
+
+        # Checkout session sweeper: pending sessions to expire / finished sessions to delete
+        await conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_pending_checkout_sessions_pending_expires_at "
+            "ON pending_checkout_sessions (expires_at) WHERE status = 'pending'"
+        ))
+        await conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_pending_checkout_sessions_finished_expires_at "
+            "ON pending_checkout_sessions (expires_at) WHERE status <> 'pending'"
+        ))
+
+        # Coupon codes are stored normalized (trimmed, upper-case) so lookups can use the
+        # unique index on code; codes that would collide with an existing one stay as they are
+        await conn.execute(text("""
+            UPDATE coupons c SET code = upper(btrim(c.code))
+            WHERE c.code <> upper(btrim(c.code))
+              AND NOT EXISTS (SELECT 1 FROM coupons d WHERE d.code = upper(btrim(c.code)))
+        """))
     print("✅ Database tables created successfully!")
 
 
@@ -0,0 +1,102 @@
+"""
+Hermann Böhmer - Product Facets
+Filter-Zähler für den Shop, berechnet in einem Durchlauf über den Katalog im Speicher
+"""
+
+from typing import Dict, Iterable, List, Optional, Set
+
+# ==================== FACET DEFINITIONS ====================
+
+# (key, lower bound inclusive, upper bound exclusive)
+PRICE_BANDS = [
+    ('0-10', 0, 10),
+    ('10-25', 10, 25),
+    ('25-50', 25, 50),
+    ('50+', 50, None),
+]
+
+ALCOHOL_BANDS = [
+    ('0-20', 0, 20),
+    ('20-35', 20, 35),
+    ('35+', 35, None),
+]
+
+FACETS = ('category', 'price', 'is_limited', 'is_18_plus', 'alcohol', 'volume_ml', 'tags')
+
+
+def _band(value, bands) -> Optional[str]:
+    for key, low, high in bands:
+        if value >= low and (high is None or value < high):
+            return key
+    return None
+
+
+def facet_values(product: dict) -> Dict[str, List[str]]:
+    """The values a product contributes to each facet"""
+    alcohol = product.get('alcohol_content')
+    volume = product.get('volume_ml')
+    return {
+        'category': [product['category']] if product.get('category') else [],
+        'price': [_band(product.get('price') or 0, PRICE_BANDS)],
+        'is_limited': ['true' if product.get('is_limited') else 'false'],
+        'is_18_plus': ['true' if product.get('is_18_plus') else 'false'],
+        'alcohol': [_band(alcohol, ALCOHOL_BANDS)] if alcohol else ['none'],
+        'volume_ml': [str(volume)] if volume else [],
+        'tags': list(product.get('tags') or []),
+    }
+
+
+# ==================== COMPUTATION ====================
+
+def compute_facets(products: Iterable[dict], filters: Dict[str, Set[str]]) -> dict:
+    """
+    Filter the products and count all facets in a single pass.
+
+    Counts are disjunctive: the counts of a facet ignore that facet's own
+    filter (so selecting "likoer" still shows how many "marmelade" there
+    are), but respect all other active filters. A product that fails
+    exactly one active filter therefore only counts towards that facet;
+    a product that fails two or more counts nowhere.
+    """
+    active = {facet: values for facet, values in filters.items() if values}
+    counts: Dict[str, Dict[str, int]] = {facet: {} for facet in FACETS}
+    matches = []
+
+    for product in products:
+        values = facet_values(product)
+        failed = [
+            facet for facet, accepted in active.items()
+            if not accepted.intersection(values[facet])
+        ]
+
+        if not failed:
+            matches.append(product)
+            count_in = FACETS
+        elif len(failed) == 1:
+            count_in = failed
+        else:
+            continue
+
+        for facet in count_in:
+            bucket = counts[facet]
+            for value in values[facet]:
+                if value is not None:
+                    bucket[value] = bucket.get(value, 0) + 1
+
+    return {
+        "total": len(matches),
+        "products": matches,
+        "facets": counts
+    }
+
+
+def parse_facet_filters(**params: Optional[str]) -> Dict[str, Set[str]]:
+    """Comma-separated query parameters -> {facet: {values}}"""
+    filters = {}
+    for facet, raw in params.items():
+        if raw is None:
+            continue
+        values = {v.strip() for v in str(raw).split(',') if v.strip() and v.strip() != 'all'}
+        if values:
+            filters[facet] = values
+    return filters
@@ -0,0 +1,224 @@
+"""
+Hermann Böhmer - Inventory
+Atomare Lagerbuchung, Reservierungen für offene Checkouts und Gutschein-Einlösung
+(jeweils ein UPDATE für alle Positionen)
+
+Verfügbar ist immer stock - reserved_stock. reserved_stock ist die laufende Summe
+der aktiven Zeilen in stock_reservations und wird in derselben Transaktion wie
+das Ledger gepflegt, daher braucht keine Abfrage ein SUM über die Reservierungen.
+"""
+
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+_COMMIT_STOCK_SQL = text("""
+    UPDATE products p
+    SET stock = p.stock - v.qty,
+        sold_count = coalesce(p.sold_count, 0) + v.qty
+    FROM unnest(CAST(:ids AS text[]), CAST(:qtys AS integer[])) AS v(id, qty)
+    WHERE p.id = v.id AND p.stock - p.reserved_stock >= v.qty
+    RETURNING p.id
+""")
+
+_RESERVE_STOCK_SQL = text("""
+    UPDATE products p
+    SET reserved_stock = p.reserved_stock + v.qty
+    FROM unnest(CAST(:ids AS text[]), CAST(:qtys AS integer[])) AS v(id, qty)
+    WHERE p.id = v.id AND p.stock - p.reserved_stock >= v.qty
+    RETURNING p.id
+""")
+
+_INSERT_RESERVATIONS_SQL = text("""
+    INSERT INTO stock_reservations (id, checkout_session_id, product_id, quantity, expires_at, created_at)
+    SELECT r.id, :session_id, r.product_id, r.qty, :expires_at, now()
+    FROM unnest(CAST(:ids AS text[]), CAST(:product_ids AS text[]), CAST(:qtys AS integer[])) AS r(id, product_id, qty)
+""")
+
+# Release = delete ledger rows and subtract them from the running totals, in one statement
+_RELEASED_TOTALS = """
+    totals AS (
+        SELECT product_id, sum(quantity) AS qty FROM released GROUP BY product_id
+    ),
+    updated AS (
+        UPDATE products p
+        SET reserved_stock = greatest(p.reserved_stock - t.qty, 0)
+        FROM totals t
+        WHERE p.id = t.product_id
+        RETURNING p.id
+    )
+    SELECT (SELECT count(*) FROM released), (SELECT count(*) FROM updated)
+"""
+
+_RELEASE_SESSION_SQL = text("""
+    WITH released AS (
+        DELETE FROM stock_reservations WHERE checkout_session_id = :session_id
+        RETURNING product_id, quantity
+    ),
+""" + _RELEASED_TOTALS)
+
+_RELEASE_EXPIRED_SQL = text("""
+    WITH expired AS (
+        SELECT id FROM stock_reservations
+        WHERE expires_at < now()
+        ORDER BY expires_at
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    ),
+    released AS (
+        DELETE FROM stock_reservations r USING expired e WHERE r.id = e.id
+        RETURNING r.product_id, r.quantity
+    ),
+""" + _RELEASED_TOTALS)
+
+# Row locks in id order: concurrent carts [A, B] and [B, A] queue up instead of deadlocking
+_LOCK_PRODUCTS_SQL = text(
+    "SELECT id FROM products WHERE id = ANY(CAST(:ids AS text[])) ORDER BY id FOR UPDATE"
+)
+
+_CURRENT_STOCK_SQL = text(
+    "SELECT id, stock - reserved_stock FROM products WHERE id = ANY(CAST(:ids AS text[]))"
+)
+
+_REDEEM_COUPON_SQL = text("""
+    UPDATE coupons
+    SET uses_count = coalesce(uses_count, 0) + 1
+    WHERE code = :code
+      AND (max_uses IS NULL OR max_uses <= 0 OR coalesce(uses_count, 0) < max_uses)
+    RETURNING id
+""")
+
+
+class StockContention(Exception):
+    """Stock rows stayed deadlocked after retrying - answer 409, the client may try again"""
+
+
+def is_deadlock(error: Exception) -> bool:
+    """True for a DBAPIError caused by a PostgreSQL deadlock (SQLSTATE 40P01)"""
+    if not isinstance(error, DBAPIError):
+        return False
+    return getattr(error.orig, 'sqlstate', None) == '40P01' or getattr(error.orig, 'pgcode', None) == '40P01'
+
+
+def product_ids(items: Iterable[dict]) -> List[str]:
+    """Distinct product ids of order lines, in lock order"""
+    return sorted({item['product_id'] for item in items})
+
+
+async def lock_products(session, ids: List[str]):
+    """Lock product rows in id order for the rest of the transaction"""
+    if len(ids) > 1:
+        await session.execute(_LOCK_PRODUCTS_SQL, {"ids": sorted(ids)})
+
+
+def _quantities(items: Iterable[dict]) -> Dict[str, int]:
+    """
+    Sum order lines per product ([{product_id, quantity}, ...]). A line with
+    a quantity below 1 raises ValueError - it would give stock back.
+    """
+    totals: Dict[str, int] = {}
+    for item in items:
+        quantity = int(item['quantity'])
+        if quantity <= 0:
+            raise ValueError(f"Invalid quantity {quantity} for product {item['product_id']}")
+        totals[item['product_id']] = totals.get(item['product_id'], 0) + quantity
+    return totals
+
+
+async def _apply_to_all(session, statement, quantities: Dict[str, int]) -> List[dict]:
+    """
+    Run a conditional per-product UPDATE for all lines at once and report
+    the lines it skipped as [{product_id, quantity, available}]
+    (available None: product no longer exists).
+    """
+    ids = sorted(quantities)
+    await lock_products(session, ids)
+    result = await session.execute(statement, {"ids": ids, "qtys": [quantities[i] for i in ids]})
+    applied = {row[0] for row in result}
+    if len(applied) == len(ids):
+        return []
+
+    missing = [product_id for product_id in ids if product_id not in applied]
+    result = await session.execute(_CURRENT_STOCK_SQL, {"ids": missing})
+    available = dict(result.all())
+    return [
+        {"product_id": product_id, "quantity": quantities[product_id], "available": available.get(product_id)}
+        for product_id in missing
+    ]
+
+
+async def commit_stock(session, items: Iterable[dict]) -> List[dict]:
+    """
+    Book all lines of an order against stock with one conditional UPDATE.
+
+    Each product is decremented only if enough is available (stock not
+    held by other checkouts), so concurrent orders can never oversell -
+    release the order's own reservation first. Returns the lines that
+    could not be booked (empty list: everything booked). Runs on the
+    caller's transaction - roll it back to undo a partial booking.
+    """
+    quantities = _quantities(items)
+    if not quantities:
+        return []
+    return await _apply_to_all(session, _COMMIT_STOCK_SQL, quantities)
+
+
+async def reserve_stock(session, checkout_session_id: str, items: Iterable[dict], expires_at: datetime) -> List[dict]:
+    """
+    Hold all lines of a new checkout until `expires_at`. Returns the lines
+    that are not available (roll back then - some holds may have been
+    taken) or an empty list after recording the holds in the ledger.
+    """
+    quantities = _quantities(items)
+    if not quantities:
+        return []
+
+    failed = await _apply_to_all(session, _RESERVE_STOCK_SQL, quantities)
+    if failed:
+        return failed
+
+    ids = list(quantities)
+    await session.execute(_INSERT_RESERVATIONS_SQL, {
+        "ids": [str(uuid.uuid4()) for _ in ids],
+        "product_ids": ids,
+        "qtys": [quantities[i] for i in ids],
+        "session_id": checkout_session_id,
+        "expires_at": expires_at
+    })
+    return []
+
+
+async def release_reservations(session, checkout_session_id: str) -> int:
+    """Drop all holds of a checkout (completed or abandoned) - returns the number of ledger rows"""
+    result = await session.execute(_RELEASE_SESSION_SQL, {"session_id": checkout_session_id})
+    return result.one()[0]
+
+
+async def release_expired_reservations(session, batch_size: int) -> int:
+    """Release up to `batch_size` expired holds (skipping rows locked by a finalization)"""
+    result = await session.execute(_RELEASE_EXPIRED_SQL, {"batch_size": batch_size})
+    return result.one()[0]
+
+
+async def redeem_coupon(session, code: Optional[str]) -> bool:
+    """Count one use of a coupon if it is active and not used up - False otherwise"""
+    if not code:
+        return True
+    result = await session.execute(_REDEEM_COUPON_SQL, {"code": code})
+    return result.first() is not None
+
+
+def describe_shortage(failed_lines: List[dict], item_details: Iterable[dict], coupon_code: Optional[str] = None) -> str:
+    """Human-readable list of the lines/coupon that could not be booked"""
+    names = {d.get('product_id'): d.get('product_name_de') for d in item_details or []}
+    parts = []
+    for line in failed_lines:
+        name = names.get(line['product_id']) or line['product_id']
+        available = line['available'] if line['available'] is not None else 'Produkt gelöscht'
+        parts.append(f"{name}: {line['quantity']} bestellt, verfügbar {available}")
+    if coupon_code:
+        parts.append(f"Gutschein {coupon_code} war bereits aufgebraucht")
+    return "; ".join(parts)
@@ -0,0 +1,69 @@
+"""
+Hermann Böhmer - Invoice Numbers
+Fortlaufende Rechnungsnummern (RE-2026-00001) aus einem Zähler pro Jahr
+
+Die Nummer wird mit einem einzigen INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+vergeben. Die Zählerzeile bleibt bis zum Ende der Bestell-Transaktion gesperrt, daher
+bekommen gleichzeitige Bestellungen verschiedene Nummern, und eine zurückgerollte
+Bestellung gibt ihre Nummer wieder frei (keine Lücken).
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+
+INVOICE_PREFIX = "RE"
+
+_ALLOCATE_SQL = text("""
+    INSERT INTO invoice_counters (year, last_number) VALUES (:year, 1)
+    ON CONFLICT (year) DO UPDATE SET last_number = invoice_counters.last_number + 1
+    RETURNING last_number
+""")
+
+# Numbers 1..last_number of the year without an order carrying them
+_MISSING_SQL = text("""
+    SELECT n FROM generate_series(1, :last_number) AS n
+    WHERE NOT EXISTS (
+        SELECT 1 FROM orders
+        WHERE invoice_number = :prefix || lpad(n::text, greatest(5, length(n::text)), '0')
+    )
+    ORDER BY n
+""")
+
+_COUNTER_SQL = text("SELECT last_number FROM invoice_counters WHERE year = :year")
+
+_ISSUED_SQL = text("SELECT count(*) FROM orders WHERE invoice_number LIKE :pattern")
+
+
+def format_invoice_number(year: int, number: int) -> str:
+    return f"{INVOICE_PREFIX}-{year}-{number:05d}"
+
+
+async def allocate_invoice_number(session, year: Optional[int] = None) -> str:
+    """Next invoice number of the year - call last in the order transaction, it locks the counter"""
+    year = year or datetime.now().year
+    result = await session.execute(_ALLOCATE_SQL, {"year": year})
+    return format_invoice_number(year, result.scalar_one())
+
+
+async def invoice_gap_report(session, year: int) -> dict:
+    """Numbers issued by the counter of `year` that no order carries (e.g. deleted orders)"""
+    result = await session.execute(_COUNTER_SQL, {"year": year})
+    last_number = result.scalar() or 0
+
+    missing = []
+    if last_number:
+        result = await session.execute(_MISSING_SQL, {
+            "last_number": last_number,
+            "prefix": f"{INVOICE_PREFIX}-{year}-"
+        })
+        missing = [format_invoice_number(year, n) for n in result.scalars()]
+
+    result = await session.execute(_ISSUED_SQL, {"pattern": f"{INVOICE_PREFIX}-{year}-%"})
+    return {
+        "year": year,
+        "last_number": format_invoice_number(year, last_number) if last_number else None,
+        "issued": result.scalar() or 0,
+        "missing": missing
+    }
@@ -0,0 +1,219 @@
+"""
+Hermann Böhmer - Order Finalization
+Macht aus einer bezahlten Checkout-Sitzung genau eine Bestellung (Demo- und Stripe-Zahlung)
+
+Die Sitzung wird mit einem bedingten UPDATE ... WHERE status = 'pending' RETURNING
+beansprucht; gleichzeitige Aufrufe (Polling, Webhook) warten auf die Zeilensperre und
+gehen danach leer aus. Bestellung, Lagerbuchung, Gutschein und Zahlung werden in
+derselben Transaktion geschrieben.
+"""
+
+import uuid
+import secrets
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from cache import product_cache, coupon_cache
+from database import (
+    async_session,
+    Order as DBOrder,
+    PaymentTransaction as DBPaymentTransaction,
+    PendingCheckoutSession as DBPendingCheckoutSession
+)
+from invoice_numbers import allocate_invoice_number
+from inventory import (
+    commit_stock, redeem_coupon, describe_shortage, release_reservations,
+    lock_products, product_ids, is_deadlock, StockContention
+)
+from popularity import popularity
+from pricing import normalize_coupon_code
+
+logger = logging.getLogger(__name__)
+
+# A transaction that lost a deadlock is rolled back by PostgreSQL and simply run again
+FINALIZE_ATTEMPTS = 3
+
+# Session fields copied onto the order unchanged
+_ORDER_FIELDS = (
+    'customer_id', 'customer_name', 'customer_email', 'customer_phone',
+    'shipping_address', 'shipping_city', 'shipping_postal', 'shipping_country',
+    'items', 'item_details', 'notes',
+    'subtotal', 'shipping_cost', 'discount_amount', 'total_amount',
+    'coupon_code', 'coupon_details'
+)
+
+
+class FinalizationError(Exception):
+    """The checkout cannot become an order - `status_code`/`detail` are returned to the client"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def generate_tracking_number() -> str:
+    """Generate unique tracking number"""
+    prefix = "HB"
+    timestamp = datetime.now().strftime("%y%m%d")
+    random_part = secrets.token_hex(3).upper()
+    return f"{prefix}{timestamp}{random_part}"
+
+
+async def _claim(session, checkout_token: str, demo: bool) -> Optional[DBPendingCheckoutSession]:
+    """Mark the session completed if it is still open - None if someone else got it first"""
+    now = datetime.now(timezone.utc)
+    statement = update(DBPendingCheckoutSession).where(DBPendingCheckoutSession.session_token == checkout_token)
+    if demo:
+        # Nothing is charged yet: only open, unexpired demo sessions
+        statement = statement.where(
+            DBPendingCheckoutSession.status == 'pending',
+            DBPendingCheckoutSession.is_demo == True,
+            DBPendingCheckoutSession.expires_at >= now
+        )
+    else:
+        # Stripe has taken the money: a session the sweeper already expired still counts
+        statement = statement.where(DBPendingCheckoutSession.status.in_(('pending', 'expired')))
+    result = await session.execute(
+        statement
+        .values(status='completed', completed_at=now)
+        .returning(DBPendingCheckoutSession)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalar_one_or_none()
+
+
+async def _unclaimable(session, checkout_token: str, stripe_session_id: Optional[str]) -> Tuple[DBOrder, bool]:
+    """Explain a failed claim: the existing order (Stripe) or why there is none"""
+    if stripe_session_id:
+        result = await session.execute(select(DBOrder).where(DBOrder.stripe_session_id == stripe_session_id))
+        order = result.scalar_one_or_none()
+        if order:
+            return order, False
+
+    result = await session.execute(
+        select(DBPendingCheckoutSession.status, DBPendingCheckoutSession.expires_at)
+        .where(DBPendingCheckoutSession.session_token == checkout_token)
+    )
+    row = result.first()
+    if row is None:
+        raise FinalizationError(404, "Checkout session not found")
+    if row.status == 'completed':
+        if stripe_session_id:
+            raise FinalizationError(400, "Session already processed but order not found")
+        raise FinalizationError(404, "Checkout session not found or already completed")
+    if row.expires_at < datetime.now(timezone.utc):
+        raise FinalizationError(410, "Checkout session expired")
+    raise FinalizationError(404, "Checkout session not found or already completed")
+
+
+async def _finalize_once(
+    checkout_token: str,
+    stripe_session_id: Optional[str],
+    payment_metadata: Optional[dict]
+) -> Tuple[DBOrder, bool]:
+    demo = stripe_session_id is None
+
+    async with async_session() as session:
+        checkout_session = await _claim(session, checkout_token, demo)
+        if checkout_session is None:
+            await session.rollback()
+            return await _unclaimable(session, checkout_token, stripe_session_id)
+
+        # Only a coupon that was applied at checkout is redeemed
+        coupon_code = normalize_coupon_code(checkout_session.coupon_code) if checkout_session.coupon_details else None
+        # Same id order as reserve_stock, before release and commit touch the rows
+        await lock_products(session, product_ids(checkout_session.items))
+        await release_reservations(session, checkout_session.id)
+        failed_lines = await commit_stock(session, checkout_session.items)
+        coupon_redeemed = await redeem_coupon(session, coupon_code)
+
+        admin_notes = None
+        if failed_lines or not coupon_redeemed:
+            shortage = describe_shortage(failed_lines, checkout_session.item_details, None if coupon_redeemed else coupon_code)
+            if demo:
+                await session.rollback()
+                raise FinalizationError(409, f"Bestellung nicht möglich: {shortage}")
+            # Payment is already captured: keep the order, book what is available
+            # and leave the shortfall for the admin to resolve
+            admin_notes = f"⚠️ Nicht gebucht: {shortage}"
+            logger.warning(f"Checkout {checkout_session.id} finalized with shortage: {shortage}")
+
+        # Locks the year's invoice counter until commit, so allocate as late as possible
+        invoice_number = await allocate_invoice_number(session)
+        order_id = str(uuid.uuid4())
+        statement = (
+            pg_insert(DBOrder)
+            .values(
+                id=order_id,
+                tracking_number=generate_tracking_number(),
+                invoice_number=invoice_number,
+                stripe_session_id=stripe_session_id,
+                admin_notes=admin_notes,
+                status='paid',
+                payment_status='paid',
+                is_new=True,
+                **{field: getattr(checkout_session, field) for field in _ORDER_FIELDS}
+            )
+            .returning(DBOrder)
+        )
+        if not demo:
+            # The partial unique index on orders.stripe_session_id is the last line of defence
+            statement = statement.on_conflict_do_nothing(
+                index_elements=[DBOrder.stripe_session_id],
+                index_where=DBOrder.stripe_session_id.isnot(None)
+            )
+        result = await session.execute(statement)
+        order = result.scalar_one_or_none()
+        if order is None:
+            await session.rollback()
+            return await _unclaimable(session, checkout_token, stripe_session_id)
+
+        session.add(DBPaymentTransaction(
+            id=str(uuid.uuid4()),
+            order_id=order_id,
+            session_id=stripe_session_id or f"demo_{checkout_token}",
+            amount=checkout_session.total_amount,
+            currency='eur',
+            payment_status='paid',
+            payment_metadata=payment_metadata or {}
+        ))
+        await session.commit()
+
+    # Stock and sold_count changed
+    product_cache.invalidate()
+    popularity.record_order(order.items)
+    if coupon_code:
+        coupon_cache.pop(coupon_code)
+    return order, True
+
+
+async def finalize_checkout(
+    checkout_token: str,
+    stripe_session_id: Optional[str] = None,
+    payment_metadata: Optional[dict] = None
+) -> Tuple[DBOrder, bool]:
+    """
+    Turn a checkout session into an order, exactly once.
+
+    Without `stripe_session_id` it is a demo checkout: nothing has been
+    charged, so any stock or coupon shortage rejects it (409). With a
+    Stripe payment the order is kept and the shortage is left in
+    admin_notes. Returns (order, created); a session that was already
+    finalized for the same Stripe payment returns the existing order
+    with created False. A deadlock on the stock rows is retried
+    FINALIZE_ATTEMPTS times. Raises FinalizationError or StockContention.
+    """
+    for attempt in range(1, FINALIZE_ATTEMPTS + 1):
+        try:
+            return await _finalize_once(checkout_token, stripe_session_id, payment_metadata)
+        except DBAPIError as e:
+            if not is_deadlock(e):
+                raise
+            logger.warning(f"Checkout {checkout_token} deadlocked (attempt {attempt}/{FINALIZE_ATTEMPTS})")
+    raise StockContention(f"Checkout {checkout_token} still deadlocked after {FINALIZE_ATTEMPTS} attempts")
@@ -0,0 +1,115 @@
+"""
+Hermann Böhmer - Password Hashing
+bcrypt läuft in einem begrenzten Thread-Pool, damit Logins den Event-Loop nicht blockieren
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+# ==================== KONFIGURATION ====================
+
+# bcrypt releases the GIL, so threads give real parallelism up to the CPU count
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Maximum number of hash/verify calls running or waiting - more are rejected
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '32'))
+
+# Number of recent calls used for the latency percentiles
+_LATENCY_SAMPLES = 500
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when the queue of pending password operations is full"""
+
+
+# ==================== POOL ====================
+
+class PasswordHasherPool:
+    """
+    Runs bcrypt on a dedicated, size-limited thread pool.
+
+    At most `max_pending` operations may be running or queued at once;
+    further calls fail fast with PasswordPoolBusy instead of piling up
+    behind a login burst.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._pending = 0
+
+        # Metrics
+        self.completed = 0
+        self.rejected = 0
+        self.max_pending_seen = 0
+        self._queue_wait = deque(maxlen=_LATENCY_SAMPLES)
+        self._run_time = deque(maxlen=_LATENCY_SAMPLES)
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordPoolBusy()
+
+        self._pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self._pending)
+        submitted = time.perf_counter()
+        timings = {}
+
+        def timed():
+            timings['started'] = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                timings['finished'] = time.perf_counter()
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self._pending -= 1
+            if 'finished' in timings:
+                self.completed += 1
+                self._queue_wait.append(timings['started'] - submitted)
+                self._run_time.append(timings['finished'] - timings['started'])
+
+    async def hash(self, password: str) -> str:
+        return await self._run(
+            lambda: bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+        )
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(
+            lambda: bcrypt.checkpw(password.encode(), hashed.encode())
+        )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        def percentiles(samples) -> dict:
+            if not samples:
+                return {"p50_ms": None, "p95_ms": None, "max_ms": None}
+            ordered = sorted(samples)
+            pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+            return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "max_ms": round(ordered[-1] * 1000, 1)}
+
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "max_pending_seen": self.max_pending_seen,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queue_wait": percentiles(self._queue_wait),
+            "run_time": percentiles(self._run_time)
+        }
+
+
+password_pool = PasswordHasherPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
@@ -0,0 +1,187 @@
+"""
+Hermann Böhmer - Popular Products
+Zeitlich gewichtetes Bestseller-Ranking, inkrementell bei jeder Bestellung aktualisiert
+"""
+
+import os
+import math
+import time
+import logging
+from bisect import bisect_left, insort
+from datetime import datetime, timezone, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from database import async_session, Order as DBOrder, Product as DBProduct
+
+logger = logging.getLogger(__name__)
+
+# ==================== KONFIGURATION ====================
+
+# A sale counts half as much after this many days
+POPULARITY_HALF_LIFE_DAYS = float(os.environ.get('POPULARITY_HALF_LIFE_DAYS', '14'))
+# How far back paid orders are replayed on startup
+POPULARITY_BOOTSTRAP_DAYS = int(os.environ.get('POPULARITY_BOOTSTRAP_DAYS', '90'))
+
+# Rebase stored scores before the forward-decay weights get too large for floats
+_MAX_WEIGHT = 1e12
+
+
+# ==================== RANKING ====================
+
+class PopularityRanking:
+    """
+    Bestseller ranking with exponentially time-decayed scores.
+
+    Uses forward decay: each sale is stored with weight exp(rate * (t - epoch)),
+    so older scores never have to be touched when time passes - the order of
+    all products stays correct and an update only moves one entry in the
+    sorted list. Each category keeps its own sorted list as well, so reading
+    the top k entries - overall or of one category - is O(k). Only products
+    that have sold are ranked.
+    """
+
+    def __init__(self, half_life_days: float):
+        self._rate = math.log(2) / (half_life_days * 86400)
+        self._epoch = time.time()
+        self._scores: Dict[str, float] = {}
+        self._ranked: List[Tuple[float, str]] = []  # (-score, product_id), ascending
+        self._categories: Dict[str, str] = {}  # product_id -> category
+        self._by_category: Dict[str, List[Tuple[float, str]]] = {}
+
+    def _weight(self, ts: float) -> float:
+        return math.exp(self._rate * (ts - self._epoch))
+
+    def _rebase(self, ts: float):
+        factor = math.exp(-self._rate * (ts - self._epoch))
+        self._epoch = ts
+        self._scores = {pid: score * factor for pid, score in self._scores.items()}
+        self._ranked = sorted((-score, pid) for pid, score in self._scores.items())
+        self._by_category = {}
+        for entry in self._ranked:
+            category = self._categories.get(entry[1])
+            if category is not None:
+                self._by_category.setdefault(category, []).append(entry)
+
+    def _views(self, product_id: str) -> List[List[Tuple[float, str]]]:
+        category = self._categories.get(product_id)
+        if category is None:
+            return [self._ranked]
+        return [self._ranked, self._by_category.setdefault(category, [])]
+
+    def _unlink(self, product_id: str):
+        old = self._scores.get(product_id)
+        if old is not None:
+            for ranked in self._views(product_id):
+                del ranked[bisect_left(ranked, (-old, product_id))]
+
+    def _set(self, product_id: str, score: float):
+        self._unlink(product_id)
+        self._scores[product_id] = score
+        for ranked in self._views(product_id):
+            insort(ranked, (-score, product_id))
+
+    def set_category(self, product_id: str, category: Optional[str]):
+        """Register (or change) the category a product is ranked under"""
+        if self._categories.get(product_id) == category:
+            return
+        score = self._scores.get(product_id)
+        self._unlink(product_id)
+        self._scores.pop(product_id, None)
+        if category is None:
+            self._categories.pop(product_id, None)
+        else:
+            self._categories[product_id] = category
+        if score is not None:
+            self._set(product_id, score)
+
+    def add_sale(self, product_id: str, quantity: int, ts: Optional[float] = None):
+        """Add `quantity` sold units of a product at time `ts` (default: now)"""
+        if quantity <= 0:
+            return
+        ts = ts if ts is not None else time.time()
+        weight = self._weight(ts)
+        if weight > _MAX_WEIGHT:
+            self._rebase(ts)
+            weight = self._weight(ts)
+        self._set(product_id, self._scores.get(product_id, 0.0) + quantity * weight)
+
+    def record_order(self, items: Iterable[dict], ts: Optional[float] = None):
+        """Add all lines of an order ([{product_id, quantity}, ...])"""
+        for item in items:
+            if item.get('product_id') and item.get('quantity'):
+                self.add_sale(item['product_id'], int(item['quantity']), ts)
+
+    def remove(self, product_id: str):
+        self._unlink(product_id)
+        self._scores.pop(product_id, None)
+        self._categories.pop(product_id, None)
+
+    def score(self, product_id: str, now: Optional[float] = None) -> float:
+        """Current decayed score (units sold, decayed to `now`)"""
+        now = now if now is not None else time.time()
+        return self._scores.get(product_id, 0.0) / self._weight(now)
+
+    def top(
+        self,
+        limit: int,
+        category: Optional[str] = None,
+        accept: Optional[Callable[[str], bool]] = None
+    ) -> List[str]:
+        """Product ids in ranking order, optionally of one category - `accept` skips ids (e.g. deleted)"""
+        ranked = self._ranked if category is None else self._by_category.get(category, [])
+        result = []
+        for _, product_id in ranked:
+            if accept is None or accept(product_id):
+                result.append(product_id)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def clear(self):
+        self._epoch = time.time()
+        self._scores = {}
+        self._ranked = []
+        self._categories = {}
+        self._by_category = {}
+
+    async def bootstrap(self):
+        """
+        Rebuild the ranking on startup: paid orders of the last
+        POPULARITY_BOOTSTRAP_DAYS are replayed with their timestamps, the
+        rest of the lifetime sold_count (units not in those orders) is added
+        as if sold at the start of that window so the rail is never empty.
+        Products that never sold stay unranked.
+        """
+        since = datetime.now(timezone.utc) - timedelta(days=POPULARITY_BOOTSTRAP_DAYS)
+        async with async_session() as session:
+            products = await session.execute(select(DBProduct.id, DBProduct.category, DBProduct.sold_count))
+            orders = await session.execute(
+                select(DBOrder.items, DBOrder.created_at).where(
+                    DBOrder.payment_status == 'paid',
+                    DBOrder.created_at >= since
+                )
+            )
+            product_rows = products.all()
+            order_rows = orders.all()
+
+        # Units of the window are already part of sold_count - count them only once
+        replayed: Dict[str, int] = {}
+        for items, _ in order_rows:
+            for item in items or []:
+                if item.get('product_id') and item.get('quantity'):
+                    replayed[item['product_id']] = replayed.get(item['product_id'], 0) + int(item['quantity'])
+
+        self.clear()
+        baseline = since.timestamp()
+        for product_id, category, sold_count in product_rows:
+            self.set_category(product_id, category)
+            self.add_sale(product_id, max(0, (sold_count or 0) - replayed.get(product_id, 0)), baseline)
+        for items, created_at in order_rows:
+            self.record_order(items or [], created_at.timestamp() if created_at else None)
+
+        logger.info(f"Popularity ranking bootstrapped ({len(product_rows)} products, {len(order_rows)} orders)")
+
+
+popularity = PopularityRanking(POPULARITY_HALF_LIFE_DAYS)
@@ -0,0 +1,167 @@
+"""
+Hermann Böhmer - Checkout Pricing
+Preisberechnung (Positionen, Versand, Rabatt, Gesamt) ohne Datenbankzugriff
+"""
+
+from datetime import datetime, timezone
+from typing import Iterable, List, Mapping, Optional, Tuple
+
+# Shipping cost for countries without an active shipping rate
+DEFAULT_SHIPPING_COST = 9.90
+
+
+class PricingError(Exception):
+    """A cart or coupon that cannot be priced - `detail` is shown to the customer"""
+
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def _as_datetime(value) -> Optional[datetime]:
+    """Coupon dates come as datetime (DB rows) or ISO strings (cached rows)"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+# ==================== LINES ====================
+
+def available_stock(product: dict) -> int:
+    """Stock not held by open checkouts"""
+    return product['stock'] - (product.get('reserved_stock') or 0)
+
+
+def price_items(items: Iterable[dict], products: Mapping[str, dict]) -> Tuple[List[dict], float]:
+    """
+    Price cart lines ([{product_id, quantity}, ...]) against a product map
+    {id: product}. Returns the line details and the subtotal.
+    """
+    subtotal = 0.0
+    lines = []
+
+    for item in items:
+        product = products.get(item['product_id'])
+        if not product:
+            raise PricingError(f"Product {item['product_id']} not found")
+
+        if available_stock(product) < item['quantity']:
+            raise PricingError(f"Not enough stock for {product['name_de']}")
+
+        price = float(product['price'])
+        line_subtotal = price * item['quantity']
+        subtotal += line_subtotal
+
+        lines.append({
+            'product_id': item['product_id'],
+            'quantity': item['quantity'],
+            'product_name_de': product['name_de'],
+            'product_name_en': product['name_en'],
+            'product_price': price,
+            'product_image_url': product['image_url'],
+            'subtotal': line_subtotal
+        })
+
+    return lines, subtotal
+
+
+# ==================== SHIPPING ====================
+
+def shipping_cost(subtotal: float, rate: Optional[dict]) -> float:
+    if not rate:
+        return DEFAULT_SHIPPING_COST
+    threshold = rate.get('free_shipping_threshold') or 0
+    if threshold > 0 and subtotal >= threshold:
+        return 0.0
+    return float(rate['rate'])
+
+
+# ==================== COUPONS ====================
+
+def normalize_coupon_code(code: str) -> str:
+    """Coupon codes are stored and looked up trimmed and upper-case"""
+    return (code or '').strip().upper()
+
+
+def check_coupon(coupon: Optional[dict], subtotal: float, now: Optional[datetime] = None):
+    """Raise PricingError (German message) if the coupon cannot be applied"""
+    if not coupon or not coupon.get('is_active', True):
+        raise PricingError("Ungültiger Gutscheincode")
+
+    now = now or datetime.now(timezone.utc)
+    valid_from = _as_datetime(coupon.get('valid_from'))
+    valid_until = _as_datetime(coupon.get('valid_until'))
+
+    if valid_from and now < valid_from:
+        raise PricingError("Dieser Gutschein ist noch nicht aktiv")
+
+    if valid_until and now > valid_until:
+        raise PricingError("Dieser Gutschein ist abgelaufen")
+
+    if coupon.get('max_uses') and (coupon.get('uses_count') or 0) >= coupon['max_uses']:
+        raise PricingError("Maximale Nutzungsanzahl erreicht")
+
+    if coupon.get('min_order_value') and subtotal < coupon['min_order_value']:
+        raise PricingError(f"Mindestbestellwert: €{coupon['min_order_value']:.2f}")
+
+
+def coupon_discount(coupon: dict, subtotal: float) -> float:
+    if coupon['discount_type'] == 'percent':
+        discount_amount = subtotal * (coupon['discount_value'] / 100)
+    else:
+        discount_amount = min(coupon['discount_value'], subtotal)
+    return round(float(discount_amount), 2)
+
+
+def apply_coupon(coupon: Optional[dict], subtotal: float, now: Optional[datetime] = None) -> dict:
+    """Validate a coupon and return its discount info (raises PricingError)"""
+    check_coupon(coupon, subtotal, now)
+    return {
+        "valid": True,
+        "code": coupon['code'],
+        "discount_type": coupon['discount_type'],
+        "discount_value": float(coupon['discount_value']),
+        "discount_amount": coupon_discount(coupon, subtotal),
+        "description": coupon.get('description') or ""
+    }
+
+
+# ==================== QUOTE ====================
+
+def quote(
+    items: Iterable[dict],
+    products: Mapping[str, dict],
+    shipping_rate: Optional[dict],
+    coupon: Optional[dict] = None,
+    coupon_code: Optional[str] = None,
+    now: Optional[datetime] = None
+) -> dict:
+    """
+    Full price quote for a cart; `shipping_rate` is the destination's rate
+    (None: default shipping cost). Unknown products and missing stock
+    raise PricingError; a coupon that does not apply is reported in
+    `coupon_error` and simply not discounted, as at checkout.
+    """
+    lines, subtotal = price_items(items, products)
+    shipping = shipping_cost(subtotal, shipping_rate)
+
+    applied = None
+    coupon_error = None
+    if coupon_code:
+        try:
+            applied = apply_coupon(coupon, subtotal, now)
+        except PricingError as e:
+            coupon_error = e.detail
+
+    discount_amount = applied['discount_amount'] if applied else 0.0
+
+    return {
+        "items": lines,
+        "subtotal": subtotal,
+        "shipping_cost": shipping,
+        "free_shipping_threshold": (shipping_rate.get('free_shipping_threshold') or 0) if shipping_rate else 0,
+        "discount_amount": discount_amount,
+        "coupon": applied,
+        "coupon_error": coupon_error,
+        "total": subtotal - discount_amount + shipping
+    }
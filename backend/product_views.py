@@ -0,0 +1,133 @@
+"""
+Hermann Böhmer - Product View Tracking
+Gepufferte Erfassung von Produktaufrufen, Bulk-Insert per COPY im Hintergrund
+"""
+
+import os
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+
+from database import engine, generate_uuid
+
+logger = logging.getLogger(__name__)
+
+# ==================== KONFIGURATION ====================
+
+# Flush as soon as this many views are buffered ...
+VIEW_FLUSH_BATCH_SIZE = int(os.environ.get('VIEW_FLUSH_BATCH_SIZE', '500'))
+# ... or at the latest after this many seconds
+VIEW_FLUSH_INTERVAL_SECONDS = float(os.environ.get('VIEW_FLUSH_INTERVAL_SECONDS', '10'))
+# Hard memory cap - further views are dropped until the next flush
+VIEW_BUFFER_MAX = int(os.environ.get('VIEW_BUFFER_MAX', '20000'))
+
+VIEW_COLUMNS = ['id', 'product_id', 'customer_id', 'session_id', 'viewed_at']
+
+
+# ==================== BUFFER ====================
+
+class ProductViewBuffer:
+    """
+    In-memory buffer for product views.
+
+    record() only appends to a bounded deque and never touches the database.
+    A background task (run) writes the buffer in bulk with asyncpg
+    copy_records_to_table every VIEW_FLUSH_BATCH_SIZE events or
+    VIEW_FLUSH_INTERVAL_SECONDS, whichever comes first.
+    """
+
+    def __init__(self, batch_size: int, interval: float, max_size: int):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_size = max_size
+        self._events = deque()
+        self._wakeup = asyncio.Event()
+
+        # Counters
+        self.recorded = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.failed_flushes = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def record(self, product_id: str, customer_id: Optional[str] = None, session_id: Optional[str] = None) -> bool:
+        """Buffer one view - returns False if it was dropped because the buffer is full"""
+        if len(self._events) >= self.max_size:
+            self.dropped += 1
+            return False
+
+        self._events.append((generate_uuid(), product_id, customer_id, session_id, datetime.now(timezone.utc)))
+        self.recorded += 1
+        if len(self._events) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def flush(self, known_product_ids: Optional[set] = None) -> int:
+        """Write all buffered views in one COPY - returns the number of rows written"""
+        if not self._events:
+            return 0
+
+        batch = []
+        while self._events:
+            batch.append(self._events.popleft())
+
+        # Views of products deleted in the meantime would fail the FK for the whole COPY
+        if known_product_ids is not None:
+            batch = [event for event in batch if event[1] in known_product_ids]
+            if not batch:
+                return 0
+
+        try:
+            async with engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                await raw.driver_connection.copy_records_to_table(
+                    'product_views', records=batch, columns=VIEW_COLUMNS
+                )
+        except Exception as e:
+            self.failed_flushes += 1
+            # Put the batch back as far as the cap allows, drop the rest
+            room = max(0, self.max_size - len(self._events))
+            self._events.extendleft(reversed(batch[:room]))
+            self.dropped += len(batch) - min(room, len(batch))
+            logger.error(f"Product view flush failed ({len(batch)} views): {e}")
+            return 0
+
+        self.flushed += len(batch)
+        return len(batch)
+
+    async def run(self, known_product_ids=None):
+        """Background flusher loop - `known_product_ids` is an async callable returning a set"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                ids = await known_product_ids() if known_product_ids else None
+                await self.flush(ids)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Product view flusher error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._events),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "failed_flushes": self.failed_flushes
+        }
+
+
+product_view_buffer = ProductViewBuffer(
+    batch_size=VIEW_FLUSH_BATCH_SIZE,
+    interval=VIEW_FLUSH_INTERVAL_SECONDS,
+    max_size=VIEW_BUFFER_MAX
+)
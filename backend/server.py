@@ -2,14 +2,15 @@
 Hermann Böhmer Shop API - PostgreSQL Version
 Complete migration from MongoDB to PostgreSQL with SQLAlchemy async
 """
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, BackgroundTasks
-from fastapi.responses import Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, BackgroundTasks, Query
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete, func, or_, and_, desc
+from sqlalchemy import select, update, delete, func, or_, and_, desc, text
 from sqlalchemy.orm import selectinload
+from sqlalchemy.exc import DBAPIError
 import os
 import logging
 from pathlib import Path
@@ -17,10 +18,12 @@ from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone, timedelta
-import bcrypt
 import jwt
 from slugify import slugify
 import secrets
+import base64
+import orjson
+import asyncio
 from contextlib import asynccontextmanager
 
 # Database imports
@@ -30,7 +33,6 @@ from database import (
     Admin as DBAdmin,
     Customer as DBCustomer,
     Order as DBOrder,
-    PaymentTransaction as DBPaymentTransaction,
     ShippingRate as DBShippingRate,
     Testimonial as DBTestimonial,
     NewsletterSubscriber as DBNewsletterSubscriber,
@@ -74,6 +76,46 @@ from notification_service import (
 # Invoice Generator
 from invoice_generator import generate_invoice_pdf, generate_invoice_filename
 
+# In-Memory Caches
+from cache import product_cache, testimonial_cache, shipping_rate_cache, customer_principals, CustomerPrincipal, admin_principals, coupon_cache
+from cache_bus import cache_bus
+
+# Product View Tracking
+from product_views import product_view_buffer
+
+# Login Admission Control
+from admission import login_admission, LoginRateLimited
+
+# Popular Products
+from popularity import popularity
+
+# Product Facets
+from facets import compute_facets, parse_facet_filters
+
+# Bulk Coupons
+from bulk_coupons import create_bulk_coupons, csv_lines, BulkCouponError, DEFAULT_ALPHABET, DEFAULT_LENGTH
+
+# Inventory
+from inventory import reserve_stock, release_reservations, is_deadlock, StockContention
+
+# Order Finalization (demo and Stripe)
+from order_finalization import finalize_checkout, FinalizationError
+from invoice_numbers import invoice_gap_report
+
+# Background Sweepers
+from sweepers import reservation_sweeper, checkout_session_sweeper
+
+# Checkout Pricing
+import pricing
+from pricing import PricingError, normalize_coupon_code
+
+# Password Hashing
+from password_hashing import password_pool, PasswordPoolBusy
+
+# Stripe (dedicated thread pool, cached session lookups)
+from stripe_gateway import StripeGateway
+from stripe_webhooks import stripe_webhooks, verify_event
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -95,6 +137,9 @@ STRIPE_DEMO_MODE = (
     not STRIPE_API_KEY.startswith('sk_')
 )
 logger.info(f"Stripe Demo Mode: {STRIPE_DEMO_MODE}")
+stripe_gateway = StripeGateway(STRIPE_API_KEY)
+# Signing secret of the /api/stripe/webhook endpoint (whsec_...) - webhook disabled without it
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
 
 # ==================== APP LIFECYCLE ====================
 
@@ -106,9 +151,27 @@ async def lifespan(app: FastAPI):
     await init_db()
     await seed_initial_data()
     logger.info("✅ PostgreSQL Database initialized!")
+    await popularity.bootstrap()
+    cache_bus.register(
+        product_cache, testimonial_cache, shipping_rate_cache,
+        coupon_cache, customer_principals, admin_principals
+    )
+    cache_listener = asyncio.create_task(cache_bus.run())
+    view_flusher = asyncio.create_task(product_view_buffer.run(known_product_ids))
+    sweeper_tasks = [
+        asyncio.create_task(sweeper.run())
+        for sweeper in (reservation_sweeper, checkout_session_sweeper)
+    ]
     yield
     # Shutdown
     logger.info("👋 Shutting down...")
+    for task in sweeper_tasks:
+        task.cancel()
+    view_flusher.cancel()
+    cache_listener.cancel()
+    await product_view_buffer.flush(await known_product_ids())
+    password_pool.shutdown()
+    stripe_gateway.shutdown()
 
 app = FastAPI(title="Hermann Böhmer Shop API - PostgreSQL", lifespan=lifespan)
 
@@ -152,6 +215,19 @@ class CouponBase(BaseModel):
     is_active: bool = True
     description: Optional[str] = None
 
+class BulkCouponCreate(BaseModel):
+    count: int
+    prefix: str = ""
+    length: int = DEFAULT_LENGTH
+    alphabet: str = DEFAULT_ALPHABET
+    discount_type: str
+    discount_value: float
+    min_order_value: Optional[float] = None
+    max_uses: Optional[int] = 1
+    valid_from: Optional[datetime] = None
+    valid_until: Optional[datetime] = None
+    description: Optional[str] = None
+
 class CouponValidation(BaseModel):
     code: str
     subtotal: float
@@ -203,7 +279,7 @@ class AdminRegister(BaseModel):
 
 class CartItem(BaseModel):
     product_id: str
-    quantity: int
+    quantity: int = Field(gt=0)
 
 class CustomerRegister(BaseModel):
     email: str
@@ -256,6 +332,11 @@ class CreateOrderRequest(BaseModel):
     customer_id: Optional[str] = None
     coupon_code: Optional[str] = None
 
+class CheckoutQuoteRequest(BaseModel):
+    items: List[CartItem]
+    shipping_country: str = "Österreich"
+    coupon_code: Optional[str] = None
+
 class ContactFormRequest(BaseModel):
     name: str
     email: str
@@ -286,11 +367,34 @@ class ShippingRateCreate(BaseModel):
 
 # ==================== AUTH HELPERS ====================
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+async def hash_password(password: str) -> str:
+    """bcrypt hash on the password worker pool (never on the event loop)"""
+    try:
+        return await password_pool.hash(password)
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please try again", headers={"Retry-After": "1"})
+
+async def verify_password(password: str, hashed: str) -> bool:
+    """bcrypt verification on the password worker pool (never on the event loop)"""
+    try:
+        return await password_pool.verify(password, hashed)
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please try again", headers={"Retry-After": "1"})
+
+def client_ip(request: Request) -> Optional[str]:
+    """Client address as forwarded by nginx (X-Real-IP), falling back to the socket peer"""
+    return request.headers.get("x-real-ip") or (request.client.host if request.client else None)
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode(), hashed.encode())
+def admit_login(request: Request, email: str):
+    """Reject excess login attempts per IP/account before any bcrypt work"""
+    try:
+        login_admission.admit(client_ip(request), email)
+    except LoginRateLimited as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts, please try again later",
+            headers={"Retry-After": str(int(e.retry_after) + 1)}
+        )
 
 def create_token(user_id: str, email: str) -> str:
     payload = {
@@ -309,8 +413,8 @@ def create_customer_token(customer_id: str, email: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_customer(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Verify customer token and return customer data"""
+async def get_current_customer(credentials: HTTPAuthorizationCredentials = Depends(security)) -> CustomerPrincipal:
+    """Verify customer token and return customer data (cached per customer for a short TTL)"""
     try:
         token = credentials.credentials
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
@@ -321,6 +425,11 @@ async def get_current_customer(credentials: HTTPAuthorizationCredentials = Depen
         if payload['exp'] < datetime.now(timezone.utc).timestamp():
             raise HTTPException(status_code=401, detail="Token expired")
         
+        principal = customer_principals.get(payload['customer_id'])
+        if principal is not None:
+            return principal
+        
+        generation = customer_principals.generation
         async with async_session() as session:
             result = await session.execute(
                 select(DBCustomer).where(DBCustomer.id == payload['customer_id'])
@@ -329,25 +438,9 @@ async def get_current_customer(credentials: HTTPAuthorizationCredentials = Depen
             if not customer:
                 raise HTTPException(status_code=401, detail="Customer not found")
             
-            return {
-                'id': customer.id,
-                'email': customer.email,
-                'first_name': customer.first_name,
-                'last_name': customer.last_name,
-                'phone': customer.phone,
-                'default_address': customer.default_address,
-                'default_city': customer.default_city,
-                'default_postal': customer.default_postal,
-                'default_country': customer.default_country,
-                'billing_address': customer.billing_address,
-                'billing_city': customer.billing_city,
-                'billing_postal': customer.billing_postal,
-                'billing_country': customer.billing_country,
-                'billing_same_as_shipping': customer.billing_same_as_shipping,
-                'cart_items': customer.cart_items or [],
-                'newsletter_subscribed': customer.newsletter_subscribed,
-                'created_at': customer.created_at.isoformat() if customer.created_at else None
-            }
+            principal = CustomerPrincipal.from_row(customer)
+            customer_principals.set(customer.id, principal, generation)
+            return principal
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
@@ -355,14 +448,20 @@ async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(
     try:
         payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         
-        async with async_session() as session:
-            result = await session.execute(
-                select(DBAdmin).where(DBAdmin.id == payload['user_id'])
-            )
-            admin = result.scalar_one_or_none()
-            if not admin:
-                raise HTTPException(status_code=401, detail="Invalid token")
-            return {'id': admin.id, 'email': admin.email}
+        admin = admin_principals.get(payload['user_id'])
+        if admin is None:
+            generation = admin_principals.generation
+            async with async_session() as session:
+                result = await session.execute(
+                    select(DBAdmin).where(DBAdmin.id == payload['user_id'])
+                )
+                row = result.scalar_one_or_none()
+            admin = {'id': row.id, 'email': row.email} if row else False
+            admin_principals.set(payload['user_id'], admin, generation)
+        
+        if not admin:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return admin
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
@@ -370,27 +469,6 @@ async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(
 
 # ==================== DATABASE HELPERS ====================
 
-def generate_tracking_number() -> str:
-    """Generate unique tracking number"""
-    prefix = "HB"
-    timestamp = datetime.now().strftime("%y%m%d")
-    random_part = secrets.token_hex(3).upper()
-    return f"{prefix}{timestamp}{random_part}"
-
-
-async def generate_invoice_number(session) -> str:
-    """Generate sequential invoice number like RE-2026-00001"""
-    year = datetime.now().year
-    result = await session.execute(
-        select(func.count(DBOrder.id)).where(
-            DBOrder.invoice_number.isnot(None),
-            DBOrder.invoice_number.like(f"RE-{year}-%")
-        )
-    )
-    count = result.scalar() or 0
-    next_number = count + 1
-    return f"RE-{year}-{next_number:05d}"
-
 def db_to_dict(obj, exclude: List[str] = None) -> dict:
     """Convert SQLAlchemy object to dictionary"""
     exclude = exclude or []
@@ -404,6 +482,25 @@ def db_to_dict(obj, exclude: List[str] = None) -> dict:
                 result[column.name] = value
     return result
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison as required for If-None-Match (nginx gzip turns strong ETags into W/...)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return any(tag.removeprefix('W/') == etag for tag in candidates)
+
+def cached_json_response(request: Request, snapshot, key, build) -> Response:
+    """
+    Serve a response from a cache snapshot: 304 if the client already has this
+    version, otherwise the pre-encoded JSON bytes (encoded once per snapshot).
+    """
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get('if-none-match'), snapshot.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.payload(key, build), media_type="application/json", headers=headers)
+
 # ==================== SEED DATA ====================
 
 async def seed_initial_data():
@@ -422,7 +519,7 @@ async def seed_initial_data():
                 admin = DBAdmin(
                     id=str(uuid.uuid4()),
                     email=initial_admin_email.lower(),
-                    password_hash=hash_password(initial_admin_password)
+                    password_hash=await hash_password(initial_admin_password)
                 )
                 session.add(admin)
                 logger.info(f"✅ Initial admin created: {initial_admin_email}")
@@ -579,41 +676,242 @@ async def seed_initial_data():
 
 # ==================== PRODUCT ROUTES ====================
 
-@api_router.get("/products")
-async def get_products(category: Optional[str] = None, featured: Optional[bool] = None):
-    async with async_session() as session:
-        query = select(DBProduct)
-        
-        if category and category != 'all':
-            query = query.where(DBProduct.category == category)
-        if featured is not None:
-            query = query.where(DBProduct.is_featured == featured)
-        
-        result = await session.execute(query.order_by(DBProduct.created_at.desc()))
-        products = result.scalars().all()
-        
-        return [db_to_dict(p) for p in products]
+# Columns that exist once per language (name_de / name_en, ...)
+LOCALIZED_PRODUCT_FIELDS = ('name', 'description')
+PRODUCT_FIELDS = tuple(c.name for c in DBProduct.__table__.columns) + ('available',)
 
-@api_router.get("/products/{slug}")
-async def get_product(slug: str):
+def encode_product_cursor(product: dict) -> str:
+    """Opaque keyset cursor for the (created_at, id) sort order"""
+    return base64.urlsafe_b64encode(orjson.dumps([product['created_at'], product['id']])).decode().rstrip('=')
+
+def decode_product_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, product_id = orjson.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Compared with (created_at, id) string tuples - anything else would fail in the sort
+    if not isinstance(created_at, (str, type(None))) or not isinstance(product_id, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return (created_at or '', product_id)
+
+def resolve_product_fields(fields: Optional[str], lang: Optional[str]) -> Optional[List[str]]:
+    """Translate fields=/lang= into the list of columns to return (None = all)"""
+    if lang is not None and lang not in ('de', 'en'):
+        raise HTTPException(status_code=400, detail="lang must be 'de' or 'en'")
+    languages = [lang] if lang else ['de', 'en']
+    
+    if fields:
+        requested = [f.strip() for f in fields.split(',') if f.strip()]
+    else:
+        if not lang:
+            return None
+        requested = list(PRODUCT_FIELDS)
+    
+    columns = []
+    for field in requested:
+        base = field.rsplit('_', 1)[0] if field.endswith(('_de', '_en')) else field
+        if base in LOCALIZED_PRODUCT_FIELDS:
+            # name -> name_de/name_en, name_en with lang=de -> dropped
+            candidates = [f"{base}_{l}" for l in languages]
+            if field != base:
+                candidates = [field] if field in candidates else []
+            columns.extend(c for c in candidates if c not in columns)
+        elif field in PRODUCT_FIELDS:
+            if field not in columns:
+                columns.append(field)
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {field}")
+    return columns
+
+@api_router.get("/products")
+async def get_products(
+    request: Request,
+    category: Optional[str] = None,
+    featured: Optional[bool] = None,
+    limit: Optional[int] = Query(None, ge=1, le=100),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    lang: Optional[str] = None
+):
+    """
+    Product list, served from the in-memory catalog - no database round trip.
+    
+    Optional keyset pagination (limit/cursor, next cursor in X-Next-Cursor),
+    sparse fieldsets (fields=name,price,image_url,slug) and language
+    projection (lang=de|en drops the other language's text columns).
+    """
+    snapshot = await product_cache.snapshot()
+    columns = resolve_product_fields(fields, lang)
+    after = decode_product_cursor(cursor) if cursor else None
+    
+    products = snapshot.rows
+    if category and category != 'all':
+        products = [p for p in products if p['category'] == category]
+    if featured is not None:
+        products = [p for p in products if p['is_featured'] == featured]
+    if after:
+        products = [p for p in products if (p['created_at'] or '', p['id']) < after]
+    
+    headers = {}
+    if limit and len(products) > limit:
+        products = products[:limit]
+        headers["X-Next-Cursor"] = encode_product_cursor(products[-1])
+    
+    def build():
+        if columns is None:
+            return products
+        return [{c: p[c] for c in columns} for p in products]
+    
+    key = ('list', category, featured, limit, cursor, tuple(columns) if columns else None)
+    response = cached_json_response(request, snapshot, key, build)
+    response.headers.update(headers)
+    return response
+
+# Always returns at least one row carrying the total; id is NULL on a page past the end
+PRODUCT_SEARCH_SQL = text("""
+    WITH matches AS (
+        SELECT p.id, ts_rank_cd(p.search_vector, q.query) AS rank
+        FROM products p,
+             (SELECT websearch_to_tsquery('german', :q)
+                  || websearch_to_tsquery('english', :q)
+                  || websearch_to_tsquery('simple', :q) AS query) q
+        WHERE p.search_vector @@ q.query
+    )
+    SELECT page.id, page.rank, t.total
+    FROM (SELECT count(*) AS total FROM matches) t
+    LEFT JOIN LATERAL (
+        SELECT id, rank FROM matches
+        ORDER BY rank DESC, id
+        LIMIT :limit OFFSET :offset
+    ) page ON true
+""")
+
+@api_router.get("/products/search")
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    fields: Optional[str] = None,
+    lang: Optional[str] = None
+):
+    """Full-text search over names, descriptions and tags (GIN index scan, ranked)"""
+    columns = resolve_product_fields(fields, lang)
+    
     async with async_session() as session:
-        # Try by slug first
         result = await session.execute(
-            select(DBProduct).where(DBProduct.slug == slug)
+            PRODUCT_SEARCH_SQL, {"q": q.strip(), "limit": limit, "offset": offset}
         )
-        product = result.scalar_one_or_none()
-        
-        # Try by ID if not found
-        if not product:
-            result = await session.execute(
-                select(DBProduct).where(DBProduct.id == slug)
-            )
-            product = result.scalar_one_or_none()
-        
-        if not product:
-            raise HTTPException(status_code=404, detail="Product not found")
-        
-        return db_to_dict(product)
+        rows = result.all()
+    total = rows[0].total
+    hits = [row for row in rows if row.id is not None]
+    
+    # Only ids and ranks come from the database - the rows from the catalog cache
+    snapshot = await product_cache.snapshot()
+    results = []
+    for hit in hits:
+        product = product_cache.lookup(snapshot, hit.id)
+        if product is None:
+            continue
+        item = product if columns is None else {c: product[c] for c in columns}
+        results.append({**item, "rank": round(float(hit.rank), 6)})
+    
+    return {
+        "query": q,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "results": results
+    }
+
+@api_router.get("/products/popular")
+async def get_popular_products(
+    category: Optional[str] = None,
+    limit: int = Query(8, ge=1, le=50)
+):
+    """Bestsellers / trending rail - read from the precomputed, time-decayed ranking"""
+    snapshot = await product_cache.snapshot()
+    
+    if category == 'all':
+        category = None
+    
+    def accept(product_id: str) -> bool:
+        return product_cache.lookup(snapshot, product_id) is not None
+    
+    return [product_cache.lookup(snapshot, pid) for pid in popularity.top(limit, category, accept)]
+
+@api_router.get("/products/facets")
+async def get_product_facets(
+    request: Request,
+    category: Optional[str] = None,
+    price: Optional[str] = None,
+    is_limited: Optional[bool] = None,
+    is_18_plus: Optional[bool] = None,
+    alcohol: Optional[str] = None,
+    volume_ml: Optional[str] = None,
+    tags: Optional[str] = None,
+    fields: Optional[str] = None,
+    lang: Optional[str] = None
+):
+    """
+    Filtered products plus counts for every facet (category, price band,
+    is_limited, is_18_plus, alcohol band, volume, tags), computed in one
+    pass over the in-memory catalog. Multi-value filters are comma-separated.
+    """
+    columns = resolve_product_fields(fields, lang)
+    filters = parse_facet_filters(
+        category=category,
+        price=price,
+        is_limited=None if is_limited is None else str(is_limited).lower(),
+        is_18_plus=None if is_18_plus is None else str(is_18_plus).lower(),
+        alcohol=alcohol,
+        volume_ml=volume_ml,
+        tags=tags
+    )
+    snapshot = await product_cache.snapshot()
+    
+    def build():
+        result = compute_facets(snapshot.rows, filters)
+        if columns is not None:
+            result["products"] = [{c: p[c] for c in columns} for p in result["products"]]
+        return result
+    
+    key = ('facets', tuple(sorted((f, tuple(sorted(v))) for f, v in filters.items())), tuple(columns) if columns else None)
+    return cached_json_response(request, snapshot, key, build)
+
+@api_router.get("/products/{slug}")
+async def get_product(request: Request, slug: str):
+    # Slug or ID, resolved via the in-memory alias index
+    snapshot, product = await product_cache.resolve(slug)
+    
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    return cached_json_response(request, snapshot, ('product', product['id']), lambda: product)
+
+async def known_product_ids() -> set:
+    """Ids of all products in the catalog cache (used to filter buffered views)"""
+    return {p['id'] for p in await product_cache.get()}
+
+@api_router.post("/products/{product_id}/view", status_code=204)
+async def record_product_view(
+    product_id: str,
+    session_id: Optional[str] = Query(None, max_length=255)
+):
+    """
+    View beacon - only buffers in memory, written to product_views in bulk by the flusher.
+    
+    navigator.sendBeacon cannot send an Authorization header, so views are
+    anonymous (optionally grouped by `session_id`). Always answers 204: the
+    beacon ignores the response, and unknown ids or a full buffer are not
+    the client's concern.
+    """
+    # Memory only: unknown ids (bots) must not cost a query, and product writes
+    # reach every worker's catalog through the cache bus
+    product = product_cache.lookup(await product_cache.snapshot(), product_id)
+    if product:
+        product_view_buffer.record(product['id'], session_id=session_id)
+    return Response(status_code=204)
 
 @api_router.post("/admin/products")
 async def create_product(product: ProductCreate, admin: dict = Depends(get_current_admin)):
@@ -636,6 +934,8 @@ async def create_product(product: ProductCreate, admin: dict = Depends(get_curre
         session.add(db_product)
         await session.commit()
         await session.refresh(db_product)
+        product_cache.invalidate()
+        popularity.set_category(db_product.id, db_product.category)
         
         return db_to_dict(db_product)
 
@@ -660,6 +960,8 @@ async def update_product(product_id: str, update: ProductUpdate, admin: dict = D
         
         await session.commit()
         await session.refresh(product)
+        product_cache.invalidate()
+        popularity.set_category(product.id, product.category)
         
         return db_to_dict(product)
 
@@ -674,8 +976,11 @@ async def delete_product(product_id: str, admin: dict = Depends(get_current_admi
         if not product:
             raise HTTPException(status_code=404, detail="Product not found")
         
+        await session.execute(delete(DBProductView).where(DBProductView.product_id == product_id))
         await session.delete(product)
         await session.commit()
+        product_cache.invalidate()
+        popularity.remove(product_id)
         
         return {"message": "Product deleted"}
 
@@ -687,8 +992,10 @@ class UnifiedLogin(BaseModel):
     language: Optional[str] = "de"
 
 @api_router.post("/auth/login")
-async def unified_login(credentials: UnifiedLogin):
+async def unified_login(credentials: UnifiedLogin, request: Request):
     """Unified login for both admin and customer"""
+    admit_login(request, credentials.email)
+    
     async with async_session() as session:
         email_lower = credentials.email.lower().strip()
         
@@ -698,7 +1005,8 @@ async def unified_login(credentials: UnifiedLogin):
         )
         admin = result.scalar_one_or_none()
         
-        if admin and verify_password(credentials.password, admin.password_hash):
+        if admin and await verify_password(credentials.password, admin.password_hash):
+            login_admission.succeeded(credentials.email)
             token = create_token(admin.id, admin.email)
             return {
                 "token": token,
@@ -712,7 +1020,7 @@ async def unified_login(credentials: UnifiedLogin):
         )
         customer = result.scalar_one_or_none()
         
-        if customer and verify_password(credentials.password, customer.password_hash):
+        if customer and await verify_password(credentials.password, customer.password_hash):
             if not customer.is_active:
                 error_msg = "Konto deaktiviert" if credentials.language == "de" else "Account deactivated"
                 raise HTTPException(status_code=403, detail=error_msg)
@@ -720,6 +1028,7 @@ async def unified_login(credentials: UnifiedLogin):
             # Update last login
             customer.last_login = datetime.now(timezone.utc)
             await session.commit()
+            login_admission.succeeded(credentials.email)
             
             token = create_customer_token(customer.id, customer.email)
             return {
@@ -765,25 +1074,29 @@ async def setup_initial_admin():
         admin = DBAdmin(
             id=str(uuid.uuid4()),
             email=initial_admin_email.lower().strip(),
-            password_hash=hash_password(initial_admin_password)
+            password_hash=await hash_password(initial_admin_password)
         )
         session.add(admin)
         await session.commit()
+        admin_principals.clear()
         
         logger.info(f"✅ Initial admin created via /admin/setup: {initial_admin_email}")
         return {"message": "Admin created successfully", "email": initial_admin_email}
 
 @api_router.post("/admin/login")
-async def admin_login(credentials: AdminLogin):
+async def admin_login(credentials: AdminLogin, request: Request):
+    admit_login(request, credentials.email)
+    
     async with async_session() as session:
         result = await session.execute(
             select(DBAdmin).where(DBAdmin.email == credentials.email)
         )
         admin = result.scalar_one_or_none()
         
-        if not admin or not verify_password(credentials.password, admin.password_hash):
+        if not admin or not await verify_password(credentials.password, admin.password_hash):
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
+        login_admission.succeeded(credentials.email)
         token = create_token(admin.id, admin.email)
         return {"token": token, "email": admin.email}
 
@@ -802,10 +1115,11 @@ async def admin_register(data: AdminRegister):
         admin = DBAdmin(
             id=str(uuid.uuid4()),
             email=data.email,
-            password_hash=hash_password(data.password)
+            password_hash=await hash_password(data.password)
         )
         session.add(admin)
         await session.commit()
+        admin_principals.clear()
         
         return {"message": "Admin registered successfully"}
 
@@ -827,7 +1141,7 @@ async def customer_register(data: CustomerRegister, background_tasks: Background
         customer = DBCustomer(
             id=str(uuid.uuid4()),
             email=data.email.lower(),
-            password_hash=hash_password(data.password),
+            password_hash=await hash_password(data.password),
             first_name=data.first_name,
             last_name=data.last_name,
             phone=data.phone
@@ -865,14 +1179,16 @@ async def customer_register(data: CustomerRegister, background_tasks: Background
         }
 
 @api_router.post("/customer/login")
-async def customer_login(data: CustomerLogin):
+async def customer_login(data: CustomerLogin, request: Request):
+    admit_login(request, data.email)
+    
     async with async_session() as session:
         result = await session.execute(
             select(DBCustomer).where(DBCustomer.email == data.email.lower())
         )
         customer = result.scalar_one_or_none()
         
-        if not customer or not verify_password(data.password, customer.password_hash):
+        if not customer or not await verify_password(data.password, customer.password_hash):
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         if not customer.is_active:
@@ -881,6 +1197,7 @@ async def customer_login(data: CustomerLogin):
         # Update last login
         customer.last_login = datetime.now(timezone.utc)
         await session.commit()
+        login_admission.succeeded(data.email)
         
         token = create_customer_token(customer.id, customer.email)
         
@@ -905,16 +1222,16 @@ async def customer_login(data: CustomerLogin):
         }
 
 @api_router.get("/customer/me")
-async def get_current_customer_me(customer: dict = Depends(get_current_customer)):
+async def get_current_customer_me(customer: CustomerPrincipal = Depends(get_current_customer)):
     """Get current logged in customer data (alias for /customer/profile)"""
-    return customer
+    return customer.to_dict()
 
 @api_router.get("/customer/profile")
-async def get_customer_profile(customer: dict = Depends(get_current_customer)):
-    return customer
+async def get_customer_profile(customer: CustomerPrincipal = Depends(get_current_customer)):
+    return customer.to_dict()
 
 @api_router.get("/customer/stats")
-async def get_customer_stats(customer: dict = Depends(get_current_customer)):
+async def get_customer_stats(customer: CustomerPrincipal = Depends(get_current_customer)):
     """Statistiken für den eingeloggten Kunden - nur bezahlte Bestellungen"""
     async with async_session() as session:
         # Anzahl Bestellungen - NUR BEZAHLT
@@ -976,7 +1293,7 @@ async def get_customer_stats(customer: dict = Depends(get_current_customer)):
         }
 
 @api_router.put("/customer/profile")
-async def update_customer_profile(update: CustomerUpdate, customer: dict = Depends(get_current_customer)):
+async def update_customer_profile(update: CustomerUpdate, customer: CustomerPrincipal = Depends(get_current_customer)):
     async with async_session() as session:
         result = await session.execute(
             select(DBCustomer).where(DBCustomer.id == customer['id'])
@@ -991,13 +1308,14 @@ async def update_customer_profile(update: CustomerUpdate, customer: dict = Depen
             setattr(db_customer, key, value)
         
         await session.commit()
+        customer_principals.pop(db_customer.id)
         await session.refresh(db_customer)
         
         return db_to_dict(db_customer, exclude=['password_hash'])
 
 @api_router.get("/customer/verify")
-async def verify_customer(customer: dict = Depends(get_current_customer)):
-    return {"valid": True, "customer": customer}
+async def verify_customer(customer: CustomerPrincipal = Depends(get_current_customer)):
+    return {"valid": True, "customer": customer.to_dict()}
 
 # ==================== PASSWORD RESET ====================
 
@@ -1074,20 +1392,21 @@ async def confirm_password_reset(data: PasswordResetConfirm):
         customer = result.scalar_one_or_none()
         
         if customer:
-            customer.password_hash = hash_password(data.new_password)
+            customer.password_hash = await hash_password(data.new_password)
             reset_token.used = True
             await session.commit()
+            customer_principals.pop(customer.id)
         
         return {"message": "Password updated successfully"}
 
 # ==================== CUSTOMER CART ====================
 
 @api_router.get("/customer/cart")
-async def get_cart(customer: dict = Depends(get_current_customer)):
+async def get_cart(customer: CustomerPrincipal = Depends(get_current_customer)):
     return {"items": customer.get('cart_items', [])}
 
 @api_router.post("/customer/cart")
-async def update_cart(items: List[CartItem], customer: dict = Depends(get_current_customer)):
+async def update_cart(items: List[CartItem], customer: CustomerPrincipal = Depends(get_current_customer)):
     async with async_session() as session:
         result = await session.execute(
             select(DBCustomer).where(DBCustomer.id == customer['id'])
@@ -1097,11 +1416,12 @@ async def update_cart(items: List[CartItem], customer: dict = Depends(get_curren
         if db_customer:
             db_customer.cart_items = [item.model_dump() for item in items]
             await session.commit()
+            customer_principals.pop(db_customer.id)
         
         return {"items": [item.model_dump() for item in items]}
 
 @api_router.delete("/customer/cart")
-async def clear_cart(customer: dict = Depends(get_current_customer)):
+async def clear_cart(customer: CustomerPrincipal = Depends(get_current_customer)):
     async with async_session() as session:
         result = await session.execute(
             select(DBCustomer).where(DBCustomer.id == customer['id'])
@@ -1111,13 +1431,14 @@ async def clear_cart(customer: dict = Depends(get_current_customer)):
         if db_customer:
             db_customer.cart_items = []
             await session.commit()
+            customer_principals.pop(db_customer.id)
         
         return {"items": []}
 
 # ==================== CUSTOMER ORDERS ====================
 
 @api_router.get("/customer/orders")
-async def get_customer_orders(customer: dict = Depends(get_current_customer)):
+async def get_customer_orders(customer: CustomerPrincipal = Depends(get_current_customer)):
     """Get customer orders - only returns paid orders"""
     async with async_session() as session:
         result = await session.execute(
@@ -1140,13 +1461,9 @@ async def get_customer_orders(customer: dict = Depends(get_current_customer)):
 # ==================== SHIPPING RATES ====================
 
 @api_router.get("/shipping-rates")
-async def get_shipping_rates():
-    async with async_session() as session:
-        result = await session.execute(
-            select(DBShippingRate).where(DBShippingRate.is_active == True)
-        )
-        rates = result.scalars().all()
-        return [db_to_dict(r) for r in rates]
+async def get_shipping_rates(request: Request):
+    snapshot = await shipping_rate_cache.snapshot()
+    return cached_json_response(request, snapshot, 'all', lambda: snapshot.rows)
 
 @api_router.post("/admin/shipping-rates")
 async def create_shipping_rate(rate: ShippingRateCreate, admin: dict = Depends(get_current_admin)):
@@ -1157,6 +1474,7 @@ async def create_shipping_rate(rate: ShippingRateCreate, admin: dict = Depends(g
         )
         session.add(db_rate)
         await session.commit()
+        shipping_rate_cache.invalidate()
         return db_to_dict(db_rate)
 
 @api_router.put("/admin/shipping-rates/{rate_id}")
@@ -1174,6 +1492,7 @@ async def update_shipping_rate(rate_id: str, rate: ShippingRateCreate, admin: di
             setattr(db_rate, key, value)
         
         await session.commit()
+        shipping_rate_cache.invalidate()
         return db_to_dict(db_rate)
 
 @api_router.delete("/admin/shipping-rates/{rate_id}")
@@ -1189,18 +1508,15 @@ async def delete_shipping_rate(rate_id: str, admin: dict = Depends(get_current_a
         
         await session.delete(db_rate)
         await session.commit()
+        shipping_rate_cache.invalidate()
         return {"message": "Shipping rate deleted"}
 
 # ==================== TESTIMONIALS ====================
 
 @api_router.get("/testimonials")
-async def get_testimonials():
-    async with async_session() as session:
-        result = await session.execute(
-            select(DBTestimonial).where(DBTestimonial.is_active == True)
-        )
-        testimonials = result.scalars().all()
-        return [db_to_dict(t) for t in testimonials]
+async def get_testimonials(request: Request):
+    snapshot = await testimonial_cache.snapshot()
+    return cached_json_response(request, snapshot, 'all', lambda: snapshot.rows)
 
 @api_router.post("/admin/testimonials")
 async def create_testimonial(testimonial: TestimonialCreate, admin: dict = Depends(get_current_admin)):
@@ -1211,6 +1527,7 @@ async def create_testimonial(testimonial: TestimonialCreate, admin: dict = Depen
         )
         session.add(db_testimonial)
         await session.commit()
+        testimonial_cache.invalidate()
         return db_to_dict(db_testimonial)
 
 @api_router.put("/admin/testimonials/{testimonial_id}")
@@ -1228,6 +1545,7 @@ async def update_testimonial(testimonial_id: str, testimonial: TestimonialCreate
             setattr(db_testimonial, key, value)
         
         await session.commit()
+        testimonial_cache.invalidate()
         return db_to_dict(db_testimonial)
 
 @api_router.delete("/admin/testimonials/{testimonial_id}")
@@ -1243,6 +1561,7 @@ async def delete_testimonial(testimonial_id: str, admin: dict = Depends(get_curr
         
         await session.delete(db_testimonial)
         await session.commit()
+        testimonial_cache.invalidate()
         return {"message": "Testimonial deleted"}
 
 # ==================== NEWSLETTER ====================
@@ -1306,50 +1625,12 @@ async def get_newsletter_subscribers(admin: dict = Depends(get_current_admin)):
 
 @api_router.post("/coupons/validate")
 async def validate_coupon(data: CouponValidation):
-    async with async_session() as session:
-        # Case-insensitive Suche - sowohl Groß- als auch Kleinschreibung akzeptieren
-        result = await session.execute(
-            select(DBCoupon).where(
-                func.upper(DBCoupon.code) == data.code.strip().upper(),
-                DBCoupon.is_active == True
-            )
-        )
-        coupon = result.scalar_one_or_none()
-        
-        if not coupon:
-            raise HTTPException(status_code=400, detail="Ungültiger Gutscheincode")
-        
-        now = datetime.now(timezone.utc)
-        
-        if coupon.valid_from and now < coupon.valid_from:
-            raise HTTPException(status_code=400, detail="Dieser Gutschein ist noch nicht aktiv")
-        
-        if coupon.valid_until and now > coupon.valid_until:
-            raise HTTPException(status_code=400, detail="Dieser Gutschein ist abgelaufen")
-        
-        if coupon.max_uses and coupon.uses_count >= coupon.max_uses:
-            raise HTTPException(status_code=400, detail="Maximale Nutzungsanzahl erreicht")
-        
-        if coupon.min_order_value and data.subtotal < coupon.min_order_value:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Mindestbestellwert: €{coupon.min_order_value:.2f}"
-            )
-        
-        # Calculate discount
-        if coupon.discount_type == 'percent':
-            discount_amount = data.subtotal * (coupon.discount_value / 100)
-        else:
-            discount_amount = min(coupon.discount_value, data.subtotal)
-        
-        return {
-            "valid": True,
-            "code": coupon.code,
-            "discount_type": coupon.discount_type,
-            "discount_value": float(coupon.discount_value),
-            "discount_amount": round(float(discount_amount), 2),
-            "description": coupon.description or ""
-        }
+    coupon = await load_coupon(data.code)
+    
+    try:
+        return pricing.apply_coupon(coupon, data.subtotal)
+    except PricingError as e:
+        raise HTTPException(status_code=400, detail=e.detail)
 
 @api_router.get("/admin/coupons")
 async def get_coupons(admin: dict = Depends(get_current_admin)):
@@ -1365,7 +1646,7 @@ async def create_coupon(coupon: CouponBase, admin: dict = Depends(get_current_ad
     async with async_session() as session:
         db_coupon = DBCoupon(
             id=str(uuid.uuid4()),
-            code=coupon.code.upper(),
+            code=normalize_coupon_code(coupon.code),
             discount_type=coupon.discount_type,
             discount_value=coupon.discount_value,
             min_order_value=coupon.min_order_value,
@@ -1377,8 +1658,30 @@ async def create_coupon(coupon: CouponBase, admin: dict = Depends(get_current_ad
         )
         session.add(db_coupon)
         await session.commit()
+        coupon_cache.pop(db_coupon.code)
         return db_to_dict(db_coupon)
 
+@api_router.post("/admin/coupons/bulk")
+async def create_coupons_bulk(data: BulkCouponCreate, admin: dict = Depends(get_current_admin)):
+    """Create many single-use codes from one template in one transaction - returns them as CSV"""
+    if data.discount_type not in ('percent', 'fixed'):
+        raise HTTPException(status_code=400, detail="discount_type must be 'percent' or 'fixed'")
+    
+    try:
+        codes = await create_bulk_coupons(**data.model_dump())
+    except BulkCouponError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    coupon_cache.clear(broadcast=False)
+    logger.info(f"{admin['email']} created {len(codes)} bulk coupons (prefix '{data.prefix}')")
+    
+    filename = f"coupons-{data.prefix.strip('-_ ') or 'bulk'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.csv"
+    return StreamingResponse(
+        csv_lines(codes),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @api_router.put("/admin/coupons/{coupon_id}")
 async def update_coupon(coupon_id: str, coupon: CouponBase, admin: dict = Depends(get_current_admin)):
     async with async_session() as session:
@@ -1390,7 +1693,8 @@ async def update_coupon(coupon_id: str, coupon: CouponBase, admin: dict = Depend
         if not db_coupon:
             raise HTTPException(status_code=404, detail="Coupon not found")
         
-        db_coupon.code = coupon.code.upper()
+        old_code = db_coupon.code
+        db_coupon.code = normalize_coupon_code(coupon.code)
         db_coupon.discount_type = coupon.discount_type
         db_coupon.discount_value = coupon.discount_value
         db_coupon.min_order_value = coupon.min_order_value
@@ -1401,6 +1705,8 @@ async def update_coupon(coupon_id: str, coupon: CouponBase, admin: dict = Depend
         db_coupon.description = coupon.description
         
         await session.commit()
+        coupon_cache.pop(old_code)
+        coupon_cache.pop(db_coupon.code)
         return db_to_dict(db_coupon)
 
 @api_router.delete("/admin/coupons/{coupon_id}")
@@ -1416,47 +1722,56 @@ async def delete_coupon(coupon_id: str, admin: dict = Depends(get_current_admin)
         
         await session.delete(db_coupon)
         await session.commit()
+        coupon_cache.pop(db_coupon.code)
         return {"message": "Coupon deleted"}
 
 # ==================== ORDERS ====================
 
-async def apply_coupon_to_order(code: str, subtotal: float) -> dict:
-    """Helper to apply coupon and return discount info"""
-    async with async_session() as session:
-        result = await session.execute(
-            select(DBCoupon).where(
-                DBCoupon.code == code.upper(),
-                DBCoupon.is_active == True
-            )
+async def load_coupon(code: str, session=None) -> Optional[dict]:
+    """
+    Coupon by code (case-insensitive) as a plain dict for the pricing engine.
+    Served from the coupon cache; a miss is one lookup on the unique code
+    index, on the caller's session if one is given.
+    """
+    code = normalize_coupon_code(code)
+    cached = coupon_cache.get(code)
+    if cached is not None:
+        return cached or None
+    
+    generation = coupon_cache.generation
+    query = select(DBCoupon).where(DBCoupon.code == code)
+    if session is None:
+        async with async_session() as own_session:
+            coupon = (await own_session.execute(query)).scalar_one_or_none()
+    else:
+        coupon = (await session.execute(query)).scalar_one_or_none()
+    
+    coupon_dict = db_to_dict(coupon) if coupon else False
+    coupon_cache.set(code, coupon_dict, generation)
+    return coupon_dict or None
+
+@api_router.post("/checkout/quote")
+async def checkout_quote(data: CheckoutQuoteRequest):
+    """Price preview for the cart - no writes, products and shipping rates from the cache"""
+    snapshot = await product_cache.snapshot()
+    products = {}
+    for item in data.items:
+        product = product_cache.lookup(snapshot, item.product_id)
+        if product and product['id'] == item.product_id:
+            products[item.product_id] = product
+    
+    coupon = await load_coupon(data.coupon_code) if data.coupon_code else None
+    
+    try:
+        return pricing.quote(
+            [item.model_dump() for item in data.items],
+            products,
+            await shipping_rate_cache.rate_for(data.shipping_country),
+            coupon=coupon,
+            coupon_code=data.coupon_code
         )
-        coupon = result.scalar_one_or_none()
-        
-        if not coupon:
-            return {"valid": False}
-        
-        now = datetime.now(timezone.utc)
-        
-        if coupon.valid_from and now < coupon.valid_from:
-            return {"valid": False}
-        if coupon.valid_until and now > coupon.valid_until:
-            return {"valid": False}
-        if coupon.max_uses and coupon.uses_count >= coupon.max_uses:
-            return {"valid": False}
-        if coupon.min_order_value and subtotal < coupon.min_order_value:
-            return {"valid": False}
-        
-        if coupon.discount_type == 'percent':
-            discount_amount = subtotal * (coupon.discount_value / 100)
-        else:
-            discount_amount = min(coupon.discount_value, subtotal)
-        
-        return {
-            "valid": True,
-            "code": coupon.code,
-            "discount_type": coupon.discount_type,
-            "discount_value": coupon.discount_value,
-            "discount_amount": round(discount_amount, 2)
-        }
+    except PricingError as e:
+        raise HTTPException(status_code=400, detail=e.detail)
 
 @api_router.post("/orders/create-checkout")
 async def create_order_with_checkout(request: Request, order_data: CreateOrderRequest, background_tasks: BackgroundTasks):
@@ -1464,62 +1779,55 @@ async def create_order_with_checkout(request: Request, order_data: CreateOrderRe
     import json
 
     async with async_session() as session:
-        subtotal = 0.0
-        item_details = []
-
-        for item in order_data.items:
-            result = await session.execute(
-                select(DBProduct).where(DBProduct.id == item.product_id)
-            )
-            product = result.scalar_one_or_none()
-
-            if not product:
-                raise HTTPException(status_code=400, detail=f"Product {item.product_id} not found")
-
-            if product.stock < item.quantity:
-                raise HTTPException(status_code=400, detail=f"Not enough stock for {product.name_de}")
-
-            item_subtotal = float(product.price) * item.quantity
-            subtotal += item_subtotal
-
-            item_details.append({
-                'product_id': item.product_id,
-                'quantity': item.quantity,
-                'product_name_de': product.name_de,
-                'product_name_en': product.name_en,
-                'product_price': float(product.price),
-                'product_image_url': product.image_url,
-                'subtotal': item_subtotal
-            })
-
+        # All cart products in one query (stock must be current, so not from the catalog cache)
+        product_ids = {item.product_id for item in order_data.items}
         result = await session.execute(
-            select(DBShippingRate).where(
-                DBShippingRate.country == order_data.shipping_country,
-                DBShippingRate.is_active == True
-            )
+            select(DBProduct).where(DBProduct.id.in_(product_ids))
         )
-        shipping_rate = result.scalar_one_or_none()
-
-        shipping_cost = 9.90
-        if shipping_rate:
-            if shipping_rate.free_shipping_threshold > 0 and subtotal >= shipping_rate.free_shipping_threshold:
-                shipping_cost = 0.0
-            else:
-                shipping_cost = float(shipping_rate.rate)
+        products = {product.id: db_to_dict(product) for product in result.scalars()}
 
-        discount_amount = 0.0
-        coupon_details = None
+        coupon = None
         if order_data.coupon_code:
-            coupon_result = await apply_coupon_to_order(order_data.coupon_code, subtotal)
-            if coupon_result.get('valid'):
-                discount_amount = coupon_result['discount_amount']
-                coupon_details = coupon_result
+            coupon = await load_coupon(order_data.coupon_code, session)
 
-        total = subtotal - discount_amount + shipping_cost
+        try:
+            price = pricing.quote(
+                [item.model_dump() for item in order_data.items],
+                products,
+                await shipping_rate_cache.rate_for(order_data.shipping_country),
+                coupon=coupon,
+                coupon_code=order_data.coupon_code
+            )
+        except PricingError as e:
+            raise HTTPException(status_code=400, detail=e.detail)
+
+        item_details = price['items']
+        subtotal = price['subtotal']
+        shipping_cost = price['shipping_cost']
+        discount_amount = price['discount_amount']
+        coupon_details = price['coupon']
+        total = price['total']
+        # An unusable code is ignored, as in the quote - only an applied coupon is redeemed later
+        coupon_code = coupon_details['code'] if coupon_details else None
+
+        # Hold the stock for this checkout until it expires (released by the sweeper otherwise)
+        pending_id = str(uuid.uuid4())
+        expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+        try:
+            failed_lines = await reserve_stock(session, pending_id, item_details, expires_at)
+        except DBAPIError as e:
+            if not is_deadlock(e):
+                raise
+            await session.rollback()
+            raise HTTPException(status_code=409, detail="Stock is busy, please try again")
+        if failed_lines:
+            await session.rollback()
+            names = ", ".join(products[line['product_id']]['name_de'] for line in failed_lines)
+            raise HTTPException(status_code=400, detail=f"Not enough stock for {names}")
 
         session_token = secrets.token_urlsafe(32)
         pending_session = DBPendingCheckoutSession(
-            id=str(uuid.uuid4()),
+            id=pending_id,
             session_token=session_token,
             customer_id=order_data.customer_id,
             customer_name=order_data.customer_name,
@@ -1536,13 +1844,15 @@ async def create_order_with_checkout(request: Request, order_data: CreateOrderRe
             shipping_cost=shipping_cost,
             discount_amount=discount_amount,
             total_amount=total,
-            coupon_code=order_data.coupon_code,
+            coupon_code=coupon_code,
             coupon_details=coupon_details,
             is_demo=STRIPE_DEMO_MODE,
-            expires_at=datetime.now(timezone.utc) + timedelta(hours=1)
+            expires_at=expires_at
         )
         session.add(pending_session)
         await session.commit()
+        # Available stock changed
+        product_cache.invalidate()
 
         if STRIPE_DEMO_MODE:
             checkout_url = f"{order_data.origin_url}/checkout/demo?token={session_token}"
@@ -1573,7 +1883,7 @@ async def create_order_with_checkout(request: Request, order_data: CreateOrderRe
                     line_items.append({
                         "price_data": {
                             "currency": "eur",
-                            "product_data": {"name": f"Rabatt ({order_data.coupon_code})"},
+                            "product_data": {"name": f"Rabatt ({coupon_code})"},
                             "unit_amount": -int(discount_amount * 100)
                         },
                         "quantity": 1
@@ -1613,6 +1923,12 @@ async def create_order_with_checkout(request: Request, order_data: CreateOrderRe
 
             except Exception as e:
                 logger.error(f"Stripe error: {e}")
+                # No payment page exists: give the held stock back right away
+                await session.rollback()
+                await release_reservations(session, pending_id)
+                pending_session.status = 'failed'
+                await session.commit()
+                product_cache.invalidate()
                 raise HTTPException(status_code=500, detail="Payment processing error")
 
 @api_router.get("/checkout/session/{token}")
@@ -1622,7 +1938,7 @@ async def get_checkout_session(token: str):
         result = await session.execute(
             select(DBPendingCheckoutSession).where(
                 DBPendingCheckoutSession.session_token == token,
-                DBPendingCheckoutSession.status == 'pending'
+                DBPendingCheckoutSession.status.in_(('pending', 'expired'))
             )
         )
         checkout_session = result.scalar_one_or_none()
@@ -1673,95 +1989,26 @@ async def complete_demo_checkout(
             detail="Invalid test card. Use 4242 4242 4242 4242 for testing."
         )
 
-    async with async_session() as session:
-        result = await session.execute(
-            select(DBPendingCheckoutSession).where(
-                DBPendingCheckoutSession.session_token == token,
-                DBPendingCheckoutSession.status == 'pending',
-                DBPendingCheckoutSession.is_demo == True
-            )
-        )
-        checkout_session = result.scalar_one_or_none()
-
-        if not checkout_session:
-            raise HTTPException(status_code=404, detail="Checkout session not found or already completed")
-
-        if checkout_session.expires_at < datetime.now(timezone.utc):
-            raise HTTPException(status_code=410, detail="Checkout session expired")
-
-        tracking_number = generate_tracking_number()
-        invoice_number = await generate_invoice_number(session)
-        order_id = str(uuid.uuid4())
-
-        order = DBOrder(
-            id=order_id,
-            tracking_number=tracking_number,
-            invoice_number=invoice_number,
-            customer_id=checkout_session.customer_id,
-            customer_name=checkout_session.customer_name,
-            customer_email=checkout_session.customer_email,
-            customer_phone=checkout_session.customer_phone,
-            shipping_address=checkout_session.shipping_address,
-            shipping_city=checkout_session.shipping_city,
-            shipping_postal=checkout_session.shipping_postal,
-            shipping_country=checkout_session.shipping_country,
-            items=checkout_session.items,
-            item_details=checkout_session.item_details,
-            notes=checkout_session.notes,
-            subtotal=checkout_session.subtotal,
-            shipping_cost=checkout_session.shipping_cost,
-            discount_amount=checkout_session.discount_amount,
-            total_amount=checkout_session.total_amount,
-            coupon_code=checkout_session.coupon_code,
-            coupon_details=checkout_session.coupon_details,
-            status='paid',
-            payment_status='paid',
-            is_new=True
-        )
-        session.add(order)
-
-        for item in checkout_session.items:
-            result = await session.execute(
-                select(DBProduct).where(DBProduct.id == item['product_id'])
-            )
-            product = result.scalar_one_or_none()
-            if product:
-                product.stock = max(0, product.stock - item['quantity'])
-                product.sold_count = (product.sold_count or 0) + item['quantity']
-
-        if checkout_session.coupon_code:
-            result = await session.execute(
-                select(DBCoupon).where(func.upper(DBCoupon.code) == checkout_session.coupon_code.upper())
-            )
-            coupon = result.scalar_one_or_none()
-            if coupon:
-                coupon.uses_count = (coupon.uses_count or 0) + 1
-
-        checkout_session.status = 'completed'
-        checkout_session.completed_at = datetime.now(timezone.utc)
-
-        transaction = DBPaymentTransaction(
-            id=str(uuid.uuid4()),
-            order_id=order_id,
-            session_id=f"demo_{token}",
-            amount=checkout_session.total_amount,
-            currency='eur',
-            payment_status='paid',
+    # Nothing is charged in demo mode, so any stock/coupon shortage rejects the order
+    try:
+        order, _ = await finalize_checkout(
+            token,
             payment_metadata={"demo": True, "card_last4": clean_card[-4:]}
         )
-        session.add(transaction)
-
-        await session.commit()
+    except FinalizationError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except StockContention:
+        raise HTTPException(status_code=409, detail="Stock is busy, please try again")
 
-        order_dict = db_to_dict(order)
-        background_tasks.add_task(send_order_confirmation, order_dict)
-        background_tasks.add_task(notify_new_order, order_dict)
+    order_dict = db_to_dict(order)
+    background_tasks.add_task(send_order_confirmation, order_dict)
+    background_tasks.add_task(notify_new_order, order_dict)
 
-        return {
-            "success": True,
-            "order": order_dict,
-            "demo_mode": True
-        }
+    return {
+        "success": True,
+        "order": order_dict,
+        "demo_mode": True
+    }
 
 @api_router.get("/payment/verify")
 @api_router.get("/orders/verify-payment")
@@ -1770,8 +2017,6 @@ async def verify_payment(
     background_tasks: BackgroundTasks = None
 ):
     """Verify Stripe payment and create order - SECURE: only creates order after Stripe confirms payment"""
-    import json
-
     if not session_id:
         raise HTTPException(status_code=400, detail="Missing session_id")
 
@@ -1780,132 +2025,83 @@ async def verify_payment(
             select(DBOrder).where(DBOrder.stripe_session_id == session_id)
         )
         existing = existing_order.scalar_one_or_none()
-        if existing:
-            return {
-                "success": True,
-                "order": db_to_dict(existing),
-                "already_processed": True
-            }
-
-        try:
-            checkout = StripeCheckout(api_key=STRIPE_API_KEY)
-            status = await checkout.get_session_status(session_id)
+    if existing:
+        return {
+            "success": True,
+            "order": db_to_dict(existing),
+            "already_processed": True
+        }
 
-            if status.status != "complete":
-                return {
-                    "success": False,
-                    "status": status.status,
-                    "message": "Payment not completed"
-                }
+    try:
+        # One (cached, coalesced) retrieval for status and metadata
+        stripe_session = await stripe_gateway.retrieve_session(session_id)
 
-            import stripe
-            stripe.api_key = STRIPE_API_KEY
-            stripe_session = stripe.checkout.Session.retrieve(session_id)
-            metadata = stripe_session.metadata
+        if stripe_session['status'] != "complete":
+            return {
+                "success": False,
+                "status": stripe_session['status'],
+                "message": "Payment not completed"
+            }
 
-            if not metadata or not metadata.get('checkout_token'):
-                raise HTTPException(status_code=400, detail="Invalid session metadata")
+        metadata = stripe_session['metadata']
 
-            checkout_token = metadata['checkout_token']
+        if not metadata or not metadata.get('checkout_token'):
+            raise HTTPException(status_code=400, detail="Invalid session metadata")
 
-            result = await session.execute(
-                select(DBPendingCheckoutSession).where(
-                    DBPendingCheckoutSession.session_token == checkout_token
-                )
-            )
-            checkout_session = result.scalar_one_or_none()
+        # Exactly once, even if several polls get here at the same time
+        try:
+            order, created = await finalize_checkout(metadata['checkout_token'], stripe_session_id=session_id)
+        except FinalizationError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except StockContention:
+            # Paid already: the client keeps polling and the next attempt books the order
+            raise HTTPException(status_code=409, detail="Stock is busy, please try again")
 
-            if not checkout_session:
-                raise HTTPException(status_code=404, detail="Checkout session not found")
+        order_dict = db_to_dict(order)
+        if not created:
+            return {"success": True, "order": order_dict, "already_processed": True}
 
-            if checkout_session.status == 'completed':
-                result = await session.execute(
-                    select(DBOrder).where(DBOrder.stripe_session_id == session_id)
-                )
-                order = result.scalar_one_or_none()
-                if order:
-                    return {"success": True, "order": db_to_dict(order)}
-                raise HTTPException(status_code=400, detail="Session already processed but order not found")
-
-            tracking_number = generate_tracking_number()
-            invoice_number = await generate_invoice_number(session)
-            order_id = str(uuid.uuid4())
-
-            order = DBOrder(
-                id=order_id,
-                tracking_number=tracking_number,
-                invoice_number=invoice_number,
-                stripe_session_id=session_id,
-                customer_id=checkout_session.customer_id,
-                customer_name=checkout_session.customer_name,
-                customer_email=checkout_session.customer_email,
-                customer_phone=checkout_session.customer_phone,
-                shipping_address=checkout_session.shipping_address,
-                shipping_city=checkout_session.shipping_city,
-                shipping_postal=checkout_session.shipping_postal,
-                shipping_country=checkout_session.shipping_country,
-                items=checkout_session.items,
-                item_details=checkout_session.item_details,
-                notes=checkout_session.notes,
-                subtotal=checkout_session.subtotal,
-                shipping_cost=checkout_session.shipping_cost,
-                discount_amount=checkout_session.discount_amount,
-                total_amount=checkout_session.total_amount,
-                coupon_code=checkout_session.coupon_code,
-                coupon_details=checkout_session.coupon_details,
-                status='paid',
-                payment_status='paid',
-                is_new=True
-            )
-            session.add(order)
+        if background_tasks:
+            background_tasks.add_task(send_order_confirmation, order_dict)
+            background_tasks.add_task(notify_new_order, order_dict)
 
-            for item in checkout_session.items:
-                result = await session.execute(
-                    select(DBProduct).where(DBProduct.id == item['product_id'])
-                )
-                product = result.scalar_one_or_none()
-                if product:
-                    product.stock = max(0, product.stock - item['quantity'])
-                    product.sold_count = (product.sold_count or 0) + item['quantity']
+        return {
+            "success": True,
+            "order": order_dict
+        }
 
-            if checkout_session.coupon_code:
-                result = await session.execute(
-                    select(DBCoupon).where(func.upper(DBCoupon.code) == checkout_session.coupon_code.upper())
-                )
-                coupon = result.scalar_one_or_none()
-                if coupon:
-                    coupon.uses_count = (coupon.uses_count or 0) + 1
-
-            transaction = DBPaymentTransaction(
-                id=str(uuid.uuid4()),
-                order_id=order_id,
-                session_id=session_id,
-                amount=checkout_session.total_amount,
-                currency='eur',
-                payment_status='paid'
-            )
-            session.add(transaction)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Payment verification error: {e}")
+        raise HTTPException(status_code=500, detail=f"Payment verification failed: {str(e)}")
 
-            checkout_session.status = 'completed'
-            checkout_session.completed_at = datetime.now(timezone.utc)
+@api_router.post("/stripe/webhook")
+async def stripe_webhook(request: Request, background_tasks: BackgroundTasks):
+    """Stripe events (signature-verified) - paid checkouts become orders without the browser"""
+    if not STRIPE_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Stripe webhook not configured")
 
-            await session.commit()
+    payload = await request.body()
+    try:
+        event = verify_event(payload, request.headers.get('stripe-signature', ''), STRIPE_WEBHOOK_SECRET)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid webhook signature")
 
-            order_dict = db_to_dict(order)
-            if background_tasks:
-                background_tasks.add_task(send_order_confirmation, order_dict)
-                background_tasks.add_task(notify_new_order, order_dict)
+    # Finalized before answering: on an error Stripe gets a 5xx and redelivers the event
+    try:
+        order = await stripe_webhooks.handle(event)
+    except Exception as e:
+        logger.error(f"Stripe webhook {event['id']} failed: {e}")
+        raise HTTPException(status_code=500, detail="Webhook processing failed, retry later")
 
-            return {
-                "success": True,
-                "order": order_dict
-            }
+    if order is None:
+        return {"received": True, "order_id": None}
 
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"Payment verification error: {e}")
-            raise HTTPException(status_code=500, detail=f"Payment verification failed: {str(e)}")
+    order_dict = db_to_dict(order)
+    background_tasks.add_task(send_order_confirmation, order_dict)
+    background_tasks.add_task(notify_new_order, order_dict)
+    return {"received": True, "order_id": order_dict['id']}
 
 @api_router.get("/checkout/status")
 async def get_checkout_status():
@@ -2090,7 +2286,7 @@ async def track_order(tracking_number: str):
 # ==================== INVOICE DOWNLOAD ====================
 
 @api_router.get("/orders/{order_id}/invoice")
-async def download_invoice_customer(order_id: str, customer: dict = Depends(get_current_customer)):
+async def download_invoice_customer(order_id: str, customer: CustomerPrincipal = Depends(get_current_customer)):
     """Download invoice as PDF for customer's own order"""
     async with async_session() as session:
         result = await session.execute(
@@ -2142,6 +2338,16 @@ async def download_invoice_admin(order_id: str, admin: dict = Depends(get_curren
         )
 
 
+@api_router.get("/admin/invoices/audit")
+async def audit_invoice_numbers(
+    admin: dict = Depends(get_current_admin),
+    year: Optional[int] = Query(None, ge=2000, le=2100)
+):
+    """Invoice numbers of a year without an order (for the accountant) - default: current year"""
+    async with async_session() as session:
+        return await invoice_gap_report(session, year or datetime.now().year)
+
+
 # ==================== CONTACT FORM ====================
 
 @api_router.post("/contact")
@@ -2259,6 +2465,7 @@ async def admin_update_customer(customer_id: str, update: CustomerUpdate, admin:
             setattr(customer, key, value)
         
         await session.commit()
+        customer_principals.pop(customer.id)
         return db_to_dict(customer, exclude=['password_hash'])
 
 @api_router.put("/admin/customers/{customer_id}/notes")
@@ -2521,7 +2728,7 @@ async def update_loyalty_settings(
         return db_to_dict(settings)
 
 @api_router.get("/customer/loyalty/points")
-async def get_customer_points(customer: dict = Depends(get_current_customer)):
+async def get_customer_points(customer: CustomerPrincipal = Depends(get_current_customer)):
     async with async_session() as session:
         result = await session.execute(
             select(func.sum(DBLoyaltyTransaction.points)).where(
@@ -2748,6 +2955,33 @@ async def get_sales_stats(admin: dict = Depends(get_current_admin), days: int =
             "total_revenue": sum(float(o.total_amount) for o in orders)
         }
 
+# ==================== ADMIN METRICS ====================
+
+@api_router.get("/admin/metrics")
+async def get_admin_metrics(admin: dict = Depends(get_current_admin)):
+    """In-process performance counters (per worker)"""
+    return {
+        "password_hashing": password_pool.stats(),
+        "stripe": stripe_gateway.stats(),
+        "stripe_webhooks": stripe_webhooks.stats(),
+        "login_admission": login_admission.stats(),
+        "product_views": product_view_buffer.stats(),
+        "caches": {
+            cache.name: {"version": cache.version, "loaded": cache.is_loaded}
+            for cache in (product_cache, testimonial_cache, shipping_rate_cache)
+        },
+        "coupons": coupon_cache.stats(),
+        "cache_bus": cache_bus.stats(),
+        "sweepers": {
+            sweeper.name: sweeper.stats()
+            for sweeper in (reservation_sweeper, checkout_session_sweeper)
+        },
+        "principals": {
+            "customer": customer_principals.stats(),
+            "admin": admin_principals.stats()
+        }
+    }
+
 # ==================== HEALTH CHECK ====================
 
 @api_router.get("/health")
@@ -0,0 +1,100 @@
+"""
+Hermann Böhmer - Stripe Gateway
+Stripe-Aufrufe laufen in einem eigenen Thread-Pool; Sitzungsabfragen werden kurz
+zwischengespeichert und gleichzeitige Abfragen derselben Sitzung zusammengelegt
+"""
+
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import stripe
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# ==================== KONFIGURATION ====================
+
+# The stripe SDK is blocking (HTTPS per call), so it never runs on the event loop
+STRIPE_WORKERS = int(os.environ.get('STRIPE_WORKERS', '8'))
+# Polling clients within this window share one retrieval per checkout session
+STRIPE_SESSION_CACHE_SECONDS = float(os.environ.get('STRIPE_SESSION_CACHE_SECONDS', '3'))
+STRIPE_SESSION_CACHE_SIZE = 5000
+
+
+def _session_info(stripe_session) -> dict:
+    """The parts of a Checkout Session the shop needs (status and metadata from one call)"""
+    return {
+        "id": stripe_session.id,
+        "status": stripe_session.status,
+        "payment_status": stripe_session.payment_status,
+        "metadata": dict(stripe_session.metadata or {})
+    }
+
+
+class StripeGateway:
+    """
+    Retrieves Stripe Checkout Sessions on a dedicated thread pool.
+
+    A result is cached for `cache_seconds` per session id, and concurrent
+    lookups of a session that is already being fetched wait for that one
+    call instead of starting their own (single flight). Errors are not
+    cached.
+    """
+
+    def __init__(self, api_key: str, workers: int = STRIPE_WORKERS, cache_seconds: float = STRIPE_SESSION_CACHE_SECONDS):
+        self.api_key = api_key
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stripe')
+        self._sessions = TTLCache('stripe_sessions', STRIPE_SESSION_CACHE_SIZE, cache_seconds)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        # Metrics
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def _retrieve(self, session_id: str) -> dict:
+        return _session_info(stripe.checkout.Session.retrieve(session_id, api_key=self.api_key))
+
+    async def _fetch(self, session_id: str) -> dict:
+        self.calls += 1
+        try:
+            info = await asyncio.get_running_loop().run_in_executor(self._executor, self._retrieve, session_id)
+        except Exception:
+            self.errors += 1
+            raise
+        self._sessions.set(session_id, info)
+        return info
+
+    async def retrieve_session(self, session_id: str) -> dict:
+        """{id, status, payment_status, metadata} of a Checkout Session (raises stripe errors)"""
+        info = self._sessions.get(session_id)
+        if info is not None:
+            return info
+
+        task = self._inflight.get(session_id)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.get_running_loop().create_task(self._fetch(session_id))
+            self._inflight[session_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(session_id, None))
+        # Shielded: one caller giving up does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "in_flight": len(self._inflight),
+            "cache": self._sessions.stats()
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,94 @@
+"""
+Hermann Böhmer - Stripe Webhooks
+Prüft die Signatur eingehender Stripe-Events und legt daraus Bestellungen an,
+auch wenn der Kunde die Erfolgsseite nie öffnet
+"""
+
+import logging
+from typing import Optional, Tuple
+
+import stripe
+
+from database import Order as DBOrder
+from order_finalization import finalize_checkout, FinalizationError
+
+logger = logging.getLogger(__name__)
+
+# Events that may complete a payment (async methods like SEPA pay after 'completed')
+FINALIZING_EVENTS = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+
+
+def verify_event(payload: bytes, signature: str, secret: str):
+    """Parse a webhook body after checking its Stripe-Signature header (raises ValueError)"""
+    try:
+        return stripe.Webhook.construct_event(payload, signature, secret)
+    except stripe.SignatureVerificationError as e:
+        raise ValueError(str(e))
+
+
+class StripeWebhookHandler:
+    """
+    Finalizes the order of a paid Checkout Session while Stripe waits for
+    the response. Finalization is idempotent, so redelivered events and
+    concurrent payment-page polls are harmless. Database errors propagate:
+    the endpoint answers 5xx and Stripe redelivers the event later, so no
+    paid checkout is lost.
+    """
+
+    def __init__(self):
+        # Metrics
+        self.received = 0
+        self.ignored = 0
+        self.orders_created = 0
+        self.already_processed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def _paid_checkout(self, event) -> Optional[Tuple[str, str]]:
+        """(checkout_token, stripe_session_id) if the event completes a payment"""
+        if event['type'] not in FINALIZING_EVENTS:
+            return None
+        checkout = event['data']['object']
+        checkout_token = (checkout.get('metadata') or {}).get('checkout_token')
+        if checkout.get('payment_status') != 'paid' or not checkout_token:
+            return None
+        return checkout_token, checkout['id']
+
+    async def handle(self, event) -> Optional[DBOrder]:
+        """Process a verified event - returns the order if this call created it"""
+        self.received += 1
+        paid = self._paid_checkout(event)
+        if paid is None:
+            self.ignored += 1
+            return None
+
+        checkout_token, stripe_session_id = paid
+        try:
+            order, created = await finalize_checkout(checkout_token, stripe_session_id=stripe_session_id)
+        except FinalizationError as e:
+            # Permanent (unknown session etc.) - redelivering would not help
+            self.rejected += 1
+            logger.error(f"Stripe session {stripe_session_id} not finalized: {e.detail}")
+            return None
+        except Exception:
+            self.failed += 1
+            raise
+
+        if not created:
+            self.already_processed += 1
+            return None
+        self.orders_created += 1
+        return order
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "ignored": self.ignored,
+            "orders_created": self.orders_created,
+            "already_processed": self.already_processed,
+            "rejected": self.rejected,
+            "failed": self.failed
+        }
+
+
+stripe_webhooks = StripeWebhookHandler()
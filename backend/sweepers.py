@@ -0,0 +1,168 @@
+"""
+Hermann Böhmer - Background Sweepers
+Periodische Aufräumjobs in kleinen Batches (abgelaufene Reservierungen, ...)
+"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import text
+
+from cache import product_cache
+from database import async_session
+from inventory import release_expired_reservations
+
+logger = logging.getLogger(__name__)
+
+# ==================== KONFIGURATION ====================
+
+RESERVATION_SWEEP_INTERVAL_SECONDS = float(os.environ.get('RESERVATION_SWEEP_INTERVAL_SECONDS', '60'))
+CHECKOUT_SESSION_SWEEP_INTERVAL_SECONDS = float(os.environ.get('CHECKOUT_SESSION_SWEEP_INTERVAL_SECONDS', '300'))
+# Expired/completed checkout sessions are kept this long after expires_at (Stripe
+# sessions can be paid up to 24 h after creation), then deleted
+CHECKOUT_SESSION_RETENTION_HOURS = float(os.environ.get('CHECKOUT_SESSION_RETENTION_HOURS', '48'))
+SWEEP_BATCH_SIZE = int(os.environ.get('SWEEP_BATCH_SIZE', '500'))
+
+# Upper bound of batches per run, so one run never monopolizes the pool
+_MAX_BATCHES_PER_RUN = 100
+
+
+class PeriodicSweeper:
+    """
+    Calls `sweep(session, batch_size)` every `interval` seconds, each batch
+    in its own short transaction, until a batch comes back smaller than
+    `batch_size`. `sweep` returns the number of rows it handled.
+    `on_swept(rows)` runs after a run that handled at least one row.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sweep: Callable[..., Awaitable[int]],
+        interval: float,
+        batch_size: int = SWEEP_BATCH_SIZE,
+        on_swept: Optional[Callable[[int], None]] = None
+    ):
+        self.name = name
+        self.interval = interval
+        self.batch_size = batch_size
+        self._sweep = sweep
+        self._on_swept = on_swept
+
+        # Metrics
+        self.runs = 0
+        self.failed_runs = 0
+        self.total_swept = 0
+        self.last_swept = 0
+        self.last_duration_ms = None
+        self.last_run_at = None
+
+    async def run_once(self) -> int:
+        started = time.perf_counter()
+        swept = 0
+        for _ in range(_MAX_BATCHES_PER_RUN):
+            async with async_session() as session:
+                count = await self._sweep(session, self.batch_size)
+                await session.commit()
+            swept += count
+            if count < self.batch_size:
+                break
+
+        self.runs += 1
+        self.total_swept += swept
+        self.last_swept = swept
+        self.last_duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.last_run_at = datetime.now(timezone.utc).isoformat()
+        if swept:
+            logger.info(f"Sweeper '{self.name}': {swept} rows in {self.last_duration_ms} ms")
+            if self._on_swept:
+                self._on_swept(swept)
+        return swept
+
+    async def run(self):
+        """Background loop"""
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed_runs += 1
+                logger.error(f"Sweeper '{self.name}' failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "batch_size": self.batch_size,
+            "runs": self.runs,
+            "failed_runs": self.failed_runs,
+            "total_swept": self.total_swept,
+            "last_swept": self.last_swept,
+            "last_duration_ms": self.last_duration_ms,
+            "last_run_at": self.last_run_at
+        }
+
+
+# ==================== CHECKOUT SESSIONS ====================
+
+# Both statements walk a partial index on expires_at (pending / not pending)
+_EXPIRE_CHECKOUT_SESSIONS_SQL = text("""
+    UPDATE pending_checkout_sessions s SET status = 'expired'
+    FROM (
+        SELECT id FROM pending_checkout_sessions
+        WHERE status = 'pending' AND expires_at < now()
+        ORDER BY expires_at
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    ) e
+    WHERE s.id = e.id
+""")
+
+_DELETE_CHECKOUT_SESSIONS_SQL = text("""
+    DELETE FROM pending_checkout_sessions s
+    USING (
+        SELECT id FROM pending_checkout_sessions
+        WHERE status <> 'pending' AND expires_at < now() - make_interval(hours => :retention_hours)
+        ORDER BY expires_at
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    ) d
+    WHERE s.id = d.id
+""")
+
+
+async def sweep_checkout_sessions(session, batch_size: int) -> int:
+    """
+    Mark up to `batch_size` abandoned checkout sessions 'expired' and delete
+    up to `batch_size` finished ones past the retention period. Their stock
+    holds expire at the same time and are released by the reservation sweeper.
+    """
+    expired = await session.execute(_EXPIRE_CHECKOUT_SESSIONS_SQL, {"batch_size": batch_size})
+    deleted = await session.execute(_DELETE_CHECKOUT_SESSIONS_SQL, {
+        "batch_size": batch_size,
+        "retention_hours": CHECKOUT_SESSION_RETENTION_HOURS
+    })
+    return expired.rowcount + deleted.rowcount
+
+
+# ==================== SWEEPERS ====================
+
+# Expired stock holds of abandoned checkouts; availability changes, so the catalog reloads
+reservation_sweeper = PeriodicSweeper(
+    'stock_reservations',
+    release_expired_reservations,
+    interval=RESERVATION_SWEEP_INTERVAL_SECONDS,
+    on_swept=lambda rows: product_cache.invalidate()
+)
+
+# Abandoned and finished checkout sessions, so the table stays small
+checkout_session_sweeper = PeriodicSweeper(
+    'checkout_sessions',
+    sweep_checkout_sessions,
+    interval=CHECKOUT_SESSION_SWEEP_INTERVAL_SECONDS
+)
@@ -9,11 +9,13 @@ export const ProductCard = ({ product, index = 0 }) => {
   const { addItem } = useCart();
 
   const name = language === 'de' ? product.name_de : product.name_en;
+  // Stock not held by other open checkouts
+  const stock = product.available ?? product.stock;
 
   const handleAddToCart = (e) => {
     e.preventDefault();
     e.stopPropagation();
-    if (product.stock > 0) {
+    if (stock > 0) {
       addItem(product, 1);
     }
   };
@@ -54,7 +56,7 @@ export const ProductCard = ({ product, index = 0 }) => {
             initial={{ opacity: 0 }}
             className="absolute bottom-4 right-4 opacity-0 group-hover:opacity-100 transition-all duration-300 w-12 h-12 bg-[#8B2E2E] text-white flex items-center justify-center hover:bg-[#7A2828]"
             onClick={handleAddToCart}
-            disabled={product.stock === 0}
+            disabled={stock === 0}
             data-testid={`quick-add-${product.id}`}
           >
             <ShoppingBag size={18} />
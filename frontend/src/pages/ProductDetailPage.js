@@ -25,6 +25,10 @@ export default function ProductDetailPage() {
       try {
         const response = await axios.get(`${API}/products/${slug}`);
         setProduct(response.data);
+        // Fire-and-forget view beacon (buffered server-side)
+        if (navigator.sendBeacon) {
+          navigator.sendBeacon(`${API}/products/${response.data.id}/view`);
+        }
       } catch (error) {
         console.error('Error fetching product:', error);
       } finally {
@@ -35,7 +39,7 @@ export default function ProductDetailPage() {
   }, [slug]);
 
   const handleAddToCart = () => {
-    if (product && product.stock > 0) {
+    if (product && (product.available ?? product.stock) > 0) {
       addItem(product, quantity);
       toast.success(language === 'de' ? 'Hinzugefügt' : 'Added to cart', {
         description: `${quantity}x ${language === 'de' ? product.name_de : product.name_en}`
@@ -79,6 +83,8 @@ export default function ProductDetailPage() {
 
   const name = language === 'de' ? product.name_de : product.name_en;
   const description = language === 'de' ? product.description_de : product.description_en;
+  // Stock not held by other open checkouts
+  const stock = product.available ?? product.stock;
 
   return (
     <main className="bg-[#F9F8F6] min-h-screen pt-28 md:pt-32" data-testid="product-detail-page">
@@ -181,8 +187,8 @@ export default function ProductDetailPage() {
               </div>
               <div>
                 <span className="text-[#969088] text-xs uppercase tracking-wider">{language === 'de' ? 'Verfügbar' : 'Available'}</span>
-                <p className={`font-serif text-lg md:text-xl mt-1 ${product.stock > 0 ? 'text-green-600' : 'text-red-500'}`}>
-                  {product.stock > 0 ? product.stock : '0'}
+                <p className={`font-serif text-lg md:text-xl mt-1 ${stock > 0 ? 'text-green-600' : 'text-red-500'}`}>
+                  {stock > 0 ? stock : '0'}
                 </p>
               </div>
             </div>
@@ -225,9 +231,9 @@ export default function ProductDetailPage() {
                   {quantity}
                 </span>
                 <button
-                  onClick={() => setQuantity(Math.min(product.stock, quantity + 1))}
+                  onClick={() => setQuantity(Math.min(stock, quantity + 1))}
                   className="qty-btn"
-                  disabled={quantity >= product.stock}
+                  disabled={quantity >= stock}
                   data-testid="quantity-plus"
                 >
                   <Plus size={16} />
@@ -236,7 +242,7 @@ export default function ProductDetailPage() {
 
               <button
                 onClick={handleAddToCart}
-                disabled={product.stock === 0}
+                disabled={stock === 0}
                 className="btn-primary flex-1 flex items-center justify-center gap-2 disabled:opacity-50 disabled:cursor-not-allowed"
                 data-testid="add-to-cart-btn"
               >
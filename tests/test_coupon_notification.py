@@ -6,6 +6,10 @@ Tests coupon validation, application, and notification service imports
 import pytest
 import requests
 import os
+import hmac
+import json
+import time
+import hashlib
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://llm-history-2.preview.emergentagent.com').rstrip('/')
 
@@ -113,6 +117,55 @@ class TestCouponAdminEndpoints:
         """Test that getting coupons without auth fails"""
         response = requests.get(f"{BASE_URL}/api/admin/coupons")
         assert response.status_code == 401 or response.status_code == 403
+    
+    def test_bulk_coupons_csv(self, admin_token):
+        """Test that bulk creation returns a CSV of distinct, valid single-use codes"""
+        response = requests.post(
+            f"{BASE_URL}/api/admin/coupons/bulk",
+            headers={"Authorization": f"Bearer {admin_token}"},
+            json={
+                "count": 3,
+                "prefix": "TESTBULK-",
+                "length": 8,
+                "discount_type": "fixed",
+                "discount_value": 5.0
+            }
+        )
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        lines = response.text.strip().splitlines()
+        assert lines[0] == "code"
+        codes = lines[1:]
+        assert len(codes) == 3
+        assert len(set(codes)) == 3
+        assert all(c.startswith("TESTBULK-") and len(c) == len("TESTBULK-") + 8 for c in codes)
+        
+        validation = requests.post(f"{BASE_URL}/api/coupons/validate", json={
+            "code": codes[0].lower(),
+            "subtotal": 50.0
+        })
+        assert validation.status_code == 200
+        assert validation.json()["discount_amount"] == 5.0
+    
+    def test_bulk_coupons_rejects_small_code_space(self, admin_token):
+        """Test that a template with too few possible codes is rejected"""
+        response = requests.post(
+            f"{BASE_URL}/api/admin/coupons/bulk",
+            headers={"Authorization": f"Bearer {admin_token}"},
+            json={"count": 100, "length": 1, "discount_type": "fixed", "discount_value": 5.0}
+        )
+        assert response.status_code == 400
+
+    def test_bulk_coupons_rejects_unsafe_prefix(self, admin_token):
+        """Test that prefixes with CSV/formula characters are rejected"""
+        for prefix in ["A,B", '"X', "=SUM"]:
+            response = requests.post(
+                f"{BASE_URL}/api/admin/coupons/bulk",
+                headers={"Authorization": f"Bearer {admin_token}"},
+                json={"count": 1, "prefix": prefix, "discount_type": "fixed", "discount_value": 5.0}
+            )
+            assert response.status_code == 400
 
 
 class TestNotificationServiceImport:
@@ -159,5 +212,176 @@ class TestCartIntegration:
         assert "name_de" in product or "name_en" in product
 
 
+class TestCheckoutQuote:
+    """Tests for the side-effect-free price preview /api/checkout/quote"""
+    
+    def _first_product(self):
+        products = requests.get(f"{BASE_URL}/api/products").json()
+        in_stock = [p for p in products if p["stock"] >= 2]
+        if not in_stock:
+            pytest.skip("No product with stock available")
+        return in_stock[0]
+    
+    def test_quote_without_coupon(self):
+        """Test that the quote adds up lines, shipping and total"""
+        product = self._first_product()
+        response = requests.post(f"{BASE_URL}/api/checkout/quote", json={
+            "items": [{"product_id": product["id"], "quantity": 2}],
+            "shipping_country": "Österreich"
+        })
+        
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert data["subtotal"] == pytest.approx(product["price"] * 2)
+        assert data["discount_amount"] == 0
+        assert data["coupon"] is None
+        assert data["total"] == pytest.approx(data["subtotal"] + data["shipping_cost"])
+        assert data["items"][0]["product_id"] == product["id"]
+    
+    def test_quote_with_coupon(self):
+        """Test that a valid coupon is applied in the quote"""
+        product = self._first_product()
+        response = requests.post(f"{BASE_URL}/api/checkout/quote", json={
+            "items": [{"product_id": product["id"], "quantity": 1}],
+            "coupon_code": "willkommen10"
+        })
+        
+        assert response.status_code == 200
+        data = response.json()
+        if data["coupon_error"]:
+            pytest.skip(f"Coupon not applicable: {data['coupon_error']}")
+        assert data["coupon"]["code"] == "WILLKOMMEN10"
+        assert data["discount_amount"] == round(data["subtotal"] * 0.1, 2)
+    
+    def test_quote_invalid_coupon_is_reported(self):
+        """Test that an unknown coupon does not fail the quote"""
+        product = self._first_product()
+        response = requests.post(f"{BASE_URL}/api/checkout/quote", json={
+            "items": [{"product_id": product["id"], "quantity": 1}],
+            "coupon_code": "INVALID_CODE_123"
+        })
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["coupon"] is None
+        assert "Ungültiger" in data["coupon_error"]
+    
+    def test_quote_country_aliases(self):
+        """Test that Österreich, Oesterreich and Austria get the same shipping rate"""
+        product = self._first_product()
+        costs = set()
+        for country in ["Österreich", "Oesterreich", "Austria"]:
+            response = requests.post(f"{BASE_URL}/api/checkout/quote", json={
+                "items": [{"product_id": product["id"], "quantity": 1}],
+                "shipping_country": country
+            })
+            assert response.status_code == 200
+            costs.add(response.json()["shipping_cost"])
+        
+        assert len(costs) == 1
+    
+    def test_quote_unknown_product(self):
+        """Test that an unknown product is rejected"""
+        response = requests.post(f"{BASE_URL}/api/checkout/quote", json={
+            "items": [{"product_id": "does-not-exist", "quantity": 1}]
+        })
+        assert response.status_code == 400
+
+
+class TestDemoCheckout:
+    """Tests for the demo checkout flow (create-checkout + demo/complete)"""
+    
+    def test_invalid_coupon_is_ignored(self):
+        """Test that an unusable coupon code neither blocks nor discounts a demo checkout"""
+        if not requests.get(f"{BASE_URL}/api/checkout/status").json().get("demo_mode"):
+            pytest.skip("Stripe configured - demo checkout not available")
+        products = requests.get(f"{BASE_URL}/api/products").json()
+        in_stock = [p for p in products if p.get("available", p["stock"]) >= 1]
+        if not in_stock:
+            pytest.skip("No product with stock available")
+        
+        checkout = requests.post(f"{BASE_URL}/api/orders/create-checkout", json={
+            "customer_name": "Test Kunde",
+            "customer_email": "test-demo-checkout@test.com",
+            "customer_phone": "+43 1 234567",
+            "shipping_address": "Teststraße 1",
+            "shipping_city": "Wien",
+            "shipping_postal": "1010",
+            "items": [{"product_id": in_stock[0]["id"], "quantity": 1}],
+            "origin_url": BASE_URL,
+            "coupon_code": "INVALID_CODE_123"
+        })
+        assert checkout.status_code == 200, checkout.text
+        
+        response = requests.post(f"{BASE_URL}/api/checkout/demo/complete", params={
+            "token": checkout.json()["session_token"],
+            "card_number": "4242 4242 4242 4242"
+        })
+        assert response.status_code == 200, response.text
+        order = response.json()["order"]
+        assert order["coupon_code"] is None
+        assert order["discount_amount"] == 0
+
+
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+
+
+def signed_webhook(event: dict, secret: str):
+    """Body and Stripe-Signature header as Stripe would send them"""
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return payload, {"Content-Type": "application/json", "Stripe-Signature": f"t={timestamp},v1={signature}"}
+
+
+def checkout_event(event_type: str, payment_status: str = "paid") -> dict:
+    return {
+        "id": "evt_test_webhook",
+        "object": "event",
+        "type": event_type,
+        "data": {"object": {
+            "id": "cs_test_webhook",
+            "object": "checkout.session",
+            "payment_status": payment_status,
+            "metadata": {"checkout_token": "unknown-checkout-token"}
+        }}
+    }
+
+
+@pytest.mark.skipif(not STRIPE_WEBHOOK_SECRET, reason="STRIPE_WEBHOOK_SECRET not set")
+class TestStripeWebhook:
+    """Tests for the signature-verified Stripe webhook /api/stripe/webhook"""
+    
+    def test_paid_checkout_unknown_session_acknowledged(self):
+        """Test that a correctly signed event for an unknown checkout is acknowledged without an order"""
+        payload, headers = signed_webhook(checkout_event("checkout.session.completed"), STRIPE_WEBHOOK_SECRET)
+        response = requests.post(f"{BASE_URL}/api/stripe/webhook", data=payload, headers=headers)
+        
+        assert response.status_code == 200, response.text
+        assert response.json() == {"received": True, "order_id": None}
+    
+    def test_unpaid_and_other_events_are_ignored(self):
+        """Test that events which do not complete a payment are acknowledged without an order"""
+        for event in [
+            checkout_event("checkout.session.completed", payment_status="unpaid"),
+            checkout_event("checkout.session.expired", payment_status="unpaid")
+        ]:
+            payload, headers = signed_webhook(event, STRIPE_WEBHOOK_SECRET)
+            response = requests.post(f"{BASE_URL}/api/stripe/webhook", data=payload, headers=headers)
+            assert response.status_code == 200
+            assert response.json()["order_id"] is None
+    
+    def test_wrong_signature_rejected(self):
+        """Test that an event signed with another secret is rejected"""
+        payload, headers = signed_webhook(checkout_event("checkout.session.completed"), "whsec_wrong")
+        response = requests.post(f"{BASE_URL}/api/stripe/webhook", data=payload, headers=headers)
+        assert response.status_code == 400
+    
+    def test_missing_signature_rejected(self):
+        """Test that an unsigned event is rejected"""
+        response = requests.post(f"{BASE_URL}/api/stripe/webhook", json=checkout_event("checkout.session.completed"))
+        assert response.status_code == 400
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "--tb=short"])
@@ -340,6 +340,30 @@ class TestCustomerOrders:
         assert isinstance(data, list)
 
 
+class TestInvoiceAudit:
+    """Admin invoice number gap audit"""
+    
+    def test_audit_current_year(self, api_client, admin_token):
+        """Test the audit reports the year's counter, issued count and missing numbers"""
+        response = api_client.get(
+            f"{BASE_URL}/api/admin/invoices/audit",
+            headers={"Authorization": f"Bearer {admin_token}"}
+        )
+        
+        assert response.status_code == 200, response.text
+        data = response.json()
+        assert "year" in data
+        assert "last_number" in data
+        assert isinstance(data["issued"], int)
+        assert isinstance(data["missing"], list)
+        assert all(number.startswith(f"RE-{data['year']}-") for number in data["missing"])
+    
+    def test_audit_requires_admin(self, api_client):
+        """Test the audit is not public"""
+        response = api_client.get(f"{BASE_URL}/api/admin/invoices/audit?year=2025")
+        assert response.status_code in [401, 403]
+
+
 class TestLoyaltyTierCalculation:
     """Test loyalty tier calculation logic"""
     
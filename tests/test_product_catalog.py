@@ -0,0 +1,254 @@
+"""
+Product Catalog Tests
+Tests for cached public read endpoints (products, testimonials, shipping rates)
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://llm-history-2.preview.emergentagent.com').rstrip('/')
+
+CACHED_ENDPOINTS = [
+    "/api/products",
+    "/api/testimonials",
+    "/api/shipping-rates",
+]
+
+
+class TestConditionalGet:
+    """ETag / If-None-Match handling for public read endpoints"""
+
+    @pytest.mark.parametrize("path", CACHED_ENDPOINTS)
+    def test_response_has_etag(self, path):
+        """Test that cached endpoints return a strong ETag"""
+        response = requests.get(f"{BASE_URL}{path}")
+
+        assert response.status_code == 200
+        etag = response.headers.get("ETag")
+        assert etag, "ETag header missing"
+        assert etag.lstrip("W/").startswith('"')
+
+    @pytest.mark.parametrize("path", CACHED_ENDPOINTS)
+    def test_if_none_match_returns_304(self, path):
+        """Test that sending the ETag back returns 304 without a body"""
+        etag = requests.get(f"{BASE_URL}{path}").headers["ETag"]
+
+        response = requests.get(f"{BASE_URL}{path}", headers={"If-None-Match": etag})
+
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers.get("ETag") == etag
+
+    def test_stale_etag_returns_full_body(self):
+        """Test that an unknown ETag returns the full list"""
+        response = requests.get(f"{BASE_URL}/api/products", headers={"If-None-Match": '"stale"'})
+
+        assert response.status_code == 200
+        assert isinstance(response.json(), list)
+
+    def test_product_detail_etag(self):
+        """Test that a single product supports conditional GET"""
+        products = requests.get(f"{BASE_URL}/api/products").json()
+        if not products:
+            pytest.skip("No products available")
+
+        slug = products[0]["slug"]
+        first = requests.get(f"{BASE_URL}/api/products/{slug}")
+        assert first.status_code == 200
+
+        second = requests.get(
+            f"{BASE_URL}/api/products/{slug}",
+            headers={"If-None-Match": first.headers["ETag"]}
+        )
+        assert second.status_code == 304
+
+    def test_unknown_product_returns_404(self):
+        """Test that a dead slug still returns 404"""
+        response = requests.get(f"{BASE_URL}/api/products/does-not-exist-xyz")
+        assert response.status_code == 404
+
+
+class TestProductListProjection:
+    """Keyset pagination, sparse fieldsets and language projection on /api/products"""
+
+    def test_default_response_unchanged(self):
+        """Test that without parameters all columns are returned"""
+        products = requests.get(f"{BASE_URL}/api/products").json()
+        if not products:
+            pytest.skip("No products available")
+
+        assert "description_de" in products[0]
+        assert "description_en" in products[0]
+
+    def test_keyset_pagination_walks_whole_catalog(self):
+        """Test that following X-Next-Cursor returns every product exactly once"""
+        all_ids = [p["id"] for p in requests.get(f"{BASE_URL}/api/products").json()]
+
+        seen = []
+        cursor = None
+        for _ in range(len(all_ids) + 1):
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = requests.get(f"{BASE_URL}/api/products", params=params)
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page) <= 2
+            seen.extend(p["id"] for p in page)
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+
+        assert seen == all_ids
+
+    def test_fields_projection(self):
+        """Test that fields= only returns the requested columns"""
+        response = requests.get(f"{BASE_URL}/api/products", params={
+            "fields": "slug,name,price,image_url",
+            "lang": "de"
+        })
+
+        assert response.status_code == 200
+        for product in response.json():
+            assert set(product.keys()) == {"slug", "name_de", "price", "image_url"}
+
+    def test_lang_projection(self):
+        """Test that lang=en drops the German text columns"""
+        response = requests.get(f"{BASE_URL}/api/products", params={"lang": "en"})
+
+        assert response.status_code == 200
+        for product in response.json():
+            assert "name_en" in product
+            assert "name_de" not in product
+            assert "description_de" not in product
+
+    def test_invalid_parameters(self):
+        """Test that unknown fields, languages and cursors are rejected"""
+        assert requests.get(f"{BASE_URL}/api/products", params={"fields": "password"}).status_code == 400
+        assert requests.get(f"{BASE_URL}/api/products", params={"lang": "fr"}).status_code == 400
+        assert requests.get(f"{BASE_URL}/api/products", params={"cursor": "!!"}).status_code == 400
+        # Decodes to [1, "x"] - right shape, wrong types
+        assert requests.get(f"{BASE_URL}/api/products", params={"cursor": "WzEsIngiXQ"}).status_code == 400
+
+
+class TestProductSearch:
+    """Full-text search endpoint /api/products/search"""
+
+    def test_search_finds_seeded_product(self):
+        """Test that a German name term finds the apricot liqueur"""
+        response = requests.get(f"{BASE_URL}/api/products/search", params={"q": "Marillenlikör"})
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] >= 1
+        assert any(p["slug"] == "wachauer-marillenlikoer" for p in data["results"])
+
+    def test_search_english_term(self):
+        """Test that English descriptions are searchable too"""
+        response = requests.get(f"{BASE_URL}/api/products/search", params={"q": "liqueur"})
+
+        assert response.status_code == 200
+        assert response.json()["total"] >= 1
+
+    def test_search_results_are_ranked(self):
+        """Test that results are ordered by descending rank"""
+        data = requests.get(f"{BASE_URL}/api/products/search", params={"q": "apricot"}).json()
+        ranks = [p["rank"] for p in data["results"]]
+        assert ranks == sorted(ranks, reverse=True)
+
+    def test_search_pagination(self):
+        """Test that limit caps the number of results"""
+        data = requests.get(f"{BASE_URL}/api/products/search", params={"q": "apricot", "limit": 1}).json()
+        assert len(data["results"]) <= 1
+
+    def test_search_total_past_last_page(self):
+        """Test that total stays correct on a page past the last result"""
+        first = requests.get(f"{BASE_URL}/api/products/search", params={"q": "liqueur"}).json()
+        past = requests.get(f"{BASE_URL}/api/products/search", params={"q": "liqueur", "offset": 1000}).json()
+        assert past["results"] == []
+        assert past["total"] == first["total"]
+
+    def test_search_no_match(self):
+        """Test that a nonsense query returns an empty result"""
+        data = requests.get(f"{BASE_URL}/api/products/search", params={"q": "xyzzyqwerty"}).json()
+        assert data["total"] == 0
+        assert data["results"] == []
+
+    def test_search_requires_query(self):
+        """Test that q is required"""
+        response = requests.get(f"{BASE_URL}/api/products/search")
+        assert response.status_code == 422
+
+
+class TestPopularProducts:
+    """Bestseller rail /api/products/popular"""
+
+    def test_popular_returns_products(self):
+        """Test that the popular endpoint returns full product objects"""
+        response = requests.get(f"{BASE_URL}/api/products/popular", params={"limit": 3})
+
+        assert response.status_code == 200
+        products = response.json()
+        assert len(products) <= 3
+        for product in products:
+            assert "slug" in product
+            assert "price" in product
+
+    def test_popular_category_filter(self):
+        """Test that the category filter only returns products of that category"""
+        response = requests.get(f"{BASE_URL}/api/products/popular", params={"category": "likoer"})
+
+        assert response.status_code == 200
+        for product in response.json():
+            assert product["category"] == "likoer"
+
+
+class TestProductViewBeacon:
+    """View beacon /api/products/{slug}/view (sent with navigator.sendBeacon)"""
+
+    def test_known_slug_returns_204(self):
+        """Test that a view of an existing product is accepted without a body"""
+        products = requests.get(f"{BASE_URL}/api/products").json()
+        if not products:
+            pytest.skip("No products available")
+
+        response = requests.post(f"{BASE_URL}/api/products/{products[0]['slug']}/view")
+
+        assert response.status_code == 204
+        assert response.content == b""
+
+    def test_unknown_slug_returns_204(self):
+        """Test that an unknown product is ignored instead of answering 404"""
+        response = requests.post(f"{BASE_URL}/api/products/gibt-es-nicht-12345/view")
+
+        assert response.status_code == 204
+
+
+class TestProductFacets:
+    """Faceted filter counts /api/products/facets"""
+
+    def test_facets_without_filters(self):
+        """Test that without filters all products match and counts add up"""
+        all_products = requests.get(f"{BASE_URL}/api/products").json()
+        response = requests.get(f"{BASE_URL}/api/products/facets")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == len(all_products)
+        assert sum(data["facets"]["category"].values()) == len(all_products)
+        for facet in ["category", "price", "is_limited", "is_18_plus", "alcohol", "volume_ml", "tags"]:
+            assert facet in data["facets"]
+
+    def test_category_filter_keeps_other_category_counts(self):
+        """Test that the category facet still counts other categories when filtering by one"""
+        unfiltered = requests.get(f"{BASE_URL}/api/products/facets").json()
+        filtered = requests.get(f"{BASE_URL}/api/products/facets", params={"category": "likoer"}).json()
+
+        assert filtered["facets"]["category"] == unfiltered["facets"]["category"]
+        assert all(p["category"] == "likoer" for p in filtered["products"])
+        assert filtered["total"] == unfiltered["facets"]["category"].get("likoer", 0)
+
+    def test_boolean_filter(self):
+        """Test that is_18_plus=true only returns age-restricted products"""
+        data = requests.get(f"{BASE_URL}/api/products/facets", params={"is_18_plus": "true"}).json()
+        assert all(p["is_18_plus"] for p in data["products"])